@@ -0,0 +1,98 @@
+import time
+import queue
+import atexit
+import signal
+import threading
+import numpy as np
+import tensorflow as tf
+
+# Saves and checkpoints on a background thread, so the training loop does not stall on the disk.  submit() takes a
+# snapshot of its arguments (NumPy arrays are copied, variables are read, tensors are immutable and passed as they are)
+# and queues the call.  The queue is bounded: when the disk falls behind, submit() blocks until there is room, and the
+# time spent waiting is reported as stalled_seconds.  Pending writes are flushed on close(), at interpreter exit and on
+# SIGTERM / SIGINT.  An exception in a write is raised again from the next submit() or close().
+_stop = object()
+
+
+def snapshot(value):
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, tf.Variable):
+        return tf.identity(value)
+    if isinstance(value, dict):
+        return {key: snapshot(x) for key, x in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(snapshot(x) for x in value)
+    return value
+
+
+def host(value):
+    # device tensors are copied to the host on the writer thread
+    return value.numpy() if isinstance(value, tf.Tensor) else value
+
+
+def save_npy(path, array):
+    np.save(path, host(array))
+
+
+class background_writer:
+    def __init__(self, max_pending=8):
+        self.jobs = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.written = 0
+        self.stalled_seconds = 0.
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="background_writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+        for signum in [signal.SIGTERM, signal.SIGINT]:
+            try:
+                previous = signal.getsignal(signum)
+                signal.signal(signum, lambda number, frame, previous=previous: self.interrupted(number, frame, previous))
+            except ValueError:
+                pass  # signal handlers can only be installed from the main thread
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is _stop:
+                return
+            function, args = job
+            try:
+                function(*args)
+                self.written += 1
+            except Exception as exception:
+                self.error = exception
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, function, *args):
+        self.check()
+        assert not self.closed, "writer is closed"
+        job = (function, snapshot(args))
+        start = time.perf_counter()
+        self.jobs.put(job)  # blocks while the queue is full
+        self.stalled_seconds += time.perf_counter() - start
+
+    def save(self, path, array):
+        self.submit(save_npy, path, array)
+
+    def pending(self):
+        return self.jobs.qsize()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.jobs.put(_stop)
+            self.thread.join()
+        self.check()
+
+    def interrupted(self, number, frame, previous):
+        self.close()
+        if callable(previous):
+            previous(number, frame)
+        else:
+            raise SystemExit(128 + number)
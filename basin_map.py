@@ -0,0 +1,146 @@
+import os
+import json
+import argparse
+import numpy as np
+import tensorflow as tf
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import bike_core
+
+# Basin of attraction of a trained controller over the initial roll omega, handle bar theta and roll rate omega_dot.
+# Start states come from a dense grid (one per cell centre) or a quasi random sequence binned into the same cells. They
+# are generated batch by batch, rolled out with bike_core.rollout in one fixed batch shape, and the survival time is
+# accumulated per cell into memory mapped arrays.  Memory is bounded by the batch size, not the grid, and an interrupted
+# map continues from the last finished batch.  Before a batch is added, the old values of the cells it touches go to a
+# journal; a batch that was added but not yet recorded in the progress file is rolled back from it on resume, so it is
+# never counted twice.
+parser = argparse.ArgumentParser(description='Map which initial states a trained policy recovers from')
+parser.add_argument('--checkpoint', type=str, default="./checkpoints/my_checkpoint")
+parser.add_argument('--output', type=str, default="basin")
+parser.add_argument('--resolution', type=int, default=64)
+parser.add_argument('--mode', type=str, default="grid", choices=["grid", "sobol"])
+parser.add_argument('--points', type=int, default=1 << 22)
+parser.add_argument('--omega_degrees', type=float, default=20.)
+parser.add_argument('--theta_degrees', type=float, default=40.)
+parser.add_argument('--omega_dot_degrees', type=float, default=60.)
+parser.add_argument('--steps', type=int, default=1000)
+parser.add_argument('--batch', type=int, default=1 << 14)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--goal', type=int, default=0)
+axes = ["omega", "theta", "omega_dot"]
+
+
+def unit_points(mode, start, n, resolution, seed):
+    # (n, 3) points in [0, 1) for the points start .. start + n of the whole sequence
+    if mode == "grid":
+        index = np.stack(np.unravel_index(np.arange(start, start + n), (resolution,) * 3), axis=1)
+        return (index + 0.5) / resolution
+    try:
+        from scipy.stats import qmc
+        sobol = qmc.Sobol(d=3, scramble=True, seed=seed)
+        sobol.fast_forward(start)
+        return sobol.random(n)
+    except ImportError:
+        # without scipy fall back to a seeded counter based stream, still reproducible per batch
+        return np.random.Generator(np.random.Philox(key=[seed, start])).random((n, 3))
+
+
+def start_states(config, unit, ranges):
+    # bike upright on the y axis, only the three mapped quantities vary
+    scaled = (2 * unit - 1) * ranges * np.pi / 180
+    zeros = np.zeros((unit.shape[0], 1))
+    states = bike_core.initial_states(config, scaled[:, 0:1], scaled[:, 1:2], zeros, zeros)
+    states[:, 1] = scaled[:, 2]
+    return states
+
+
+def open_arrays(output, resolution):
+    shape = (resolution,) * 3
+    arrays = []
+    for name in ["survival_sum", "count"]:
+        path = output + "_" + name + ".npy"
+        mode = "r+" if os.path.exists(path) else "w+"
+        arrays.append(np.lib.format.open_memmap(path, mode=mode, dtype=np.float64, shape=shape))
+    return arrays
+
+
+def write_atomically(path, write):
+    # write(file) goes to a temporary file that replaces path in one rename, so path is always complete
+    with open(path + ".tmp", "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def roll_back(journal_path, done, arrays):
+    # undoes the batch recorded in the journal if the progress file does not count it yet
+    if not os.path.exists(journal_path):
+        return
+    journal = np.load(journal_path)
+    if int(journal["start"]) == done:
+        for array, before in zip(arrays, [journal["survival_sum"], journal["count"]]):
+            array.reshape(-1)[journal["cells"]] = before
+            array.flush()
+        print("rolled back the unfinished batch at", done)
+    os.remove(journal_path)
+
+
+def render(output, survival_sum, count, ranges, steps):
+    # one heatmap per pair of axes, averaged over the remaining axis
+    figure, panels = plt.subplots(1, 3, figsize=(15, 4.5))
+    for panel, (a, b) in zip(panels, [(0, 1), (0, 2), (1, 2)]):
+        other = 3 - a - b
+        mean = np.sum(survival_sum, axis=other) / np.maximum(np.sum(count, axis=other), 1)
+        image = panel.imshow(mean.T, origin="lower", aspect="auto", vmin=0, vmax=steps,
+                             extent=[-ranges[a], ranges[a], -ranges[b], ranges[b]])
+        panel.set(xlabel=axes[a] + " (degrees)", ylabel=axes[b] + " (degrees" + ("/s)" if b == 2 else ")"))
+        panel.set_title("mean balance steps")
+        figure.colorbar(image, ax=panel)
+    figure.tight_layout()
+    figure.savefig(output + ".png")
+    plt.close(figure)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    config = bike_core.default_config()
+    config["goal"] = bool(args.goal)
+    ranges = np.array([args.omega_degrees, args.theta_degrees, args.omega_dot_degrees])
+    resolution = args.resolution
+    total = resolution ** 3 if args.mode == "grid" else args.points
+    network = bike_core.build_network(config)
+    network.load_weights(args.checkpoint).expect_partial()
+    weights = tf.constant(bike_core.reward_weights(config))
+    goal_position = tf.constant(np.tile([[config["xg"], config["yg"]]], (args.batch, 1)))
+
+    @tf.function(input_signature=[tf.TensorSpec([args.batch, bike_core.state_dimension], tf.float64)])
+    def survival(states):
+        return bike_core.rollout(network, states, tf.constant(args.steps), config, goal_position, weights)[0]
+
+    survival_sum, count = open_arrays(args.output, resolution)
+    progress_path = args.output + "_progress.json"
+    journal_path = args.output + "_journal.npz"
+    done = json.load(open(progress_path))["done"] if os.path.exists(progress_path) else 0
+    roll_back(journal_path, done, [survival_sum, count])
+    for start in range(done, total, args.batch):
+        n = min(args.batch, total - start)
+        unit = unit_points(args.mode, start, n, resolution, args.seed)
+        states = start_states(config, unit, ranges)
+        if n < args.batch:
+            states = np.concatenate([states, np.repeat(states[-1:], args.batch - n, axis=0)])
+        steps = survival(tf.constant(states)).numpy()[:n]
+        cells = tuple(np.minimum((unit * resolution).astype(np.int64), resolution - 1).T)
+        touched = np.unique(np.ravel_multi_index(cells, survival_sum.shape))
+        write_atomically(journal_path, lambda f: np.savez(f, start=start, cells=touched,
+                                                          survival_sum=survival_sum.reshape(-1)[touched],
+                                                          count=count.reshape(-1)[touched]))
+        np.add.at(survival_sum, cells, steps)
+        np.add.at(count, cells, 1.)
+        survival_sum.flush()
+        count.flush()
+        write_atomically(progress_path, lambda f: f.write(json.dumps({"done": start + n, "total": total}).encode()))
+        os.remove(journal_path)
+        print("mapped", start + n, "of", total, "start states")
+    render(args.output, np.asarray(survival_sum), np.asarray(count), ranges, args.steps)
@@ -0,0 +1,61 @@
+import math
+
+# Constants and default experiment settings of the bike, without TensorFlow, for tools that only need these (the
+# trajectory archive and renderer workers).  bike_core re-exports everything here.
+
+#BIKE PHYSICS
+# Units in meters and kilograms
+c = 0.66  # Horizontal distance between point where front wheel touches ground and centre of mass
+d_cm = 0.30  # Vertical distance between center of mass and cyclist
+h = 0.94  # Height of center of mass over the ground
+l = 1.11  # Distance between front tire and back tire at the point where they touch the ground.
+m_c = 15.0  # mass of bicycle
+m_d = 1.7  # mass of tire
+m_p = 60.0  # mass of cyclist
+r = 0.34  # radius of tire
+v = 10.0 / 3.6  # velocity of the bicycle in m / s 2.7
+# Useful Precomputations
+m = m_c + m_p
+inertia_bc = (13. / 3) * m_c * h ** 2 + m_p * (h + d_cm) ** 2  # inertia of bicycle and cyclist
+inertia_dv = (3. / 2) * (m_d * (r ** 2))  # Various inertia of tires
+inertia_dl = .5 * (m_d * (r ** 2))  # Various inertia of tires
+inertia_dc = m_d * (r ** 2)  # Various inertia of tires
+sigma_dot = float(v) / r
+# Simulation constants
+gravity = 9.82
+delta_time = 0.01  # 0.01 # 0.054 m forward per delta time
+crash_angle = math.pi / 9  # early termination roll angle used by bikebptt_parallelised3.py
+state_dimension = 12  # omega, omega_dot, omega_ddot, theta, theta_dot, x_f, y_f, x_b, y_b, psi,psig, timestep
+state_columns = ["omega", "omega_dot", "omega_ddot", "theta", "theta_dot", "x_f", "y_f", "x_b", "y_b", "psi", "psig",
+                 "timestep"]
+observation_dimension = 6  # omega, omega_dot, theta, theta_dot, sin(heading), cos(heading)
+# columns of the per-row reward weights: psi penalty, angle penalty, handle penalty, tanh wrapper, goal reward
+reward_dimension = 5
+# columns of the optional per-row physics parameters passed to step(), the inertias are derived from them in the graph
+physics_names = ["c", "d_cm", "h", "l", "m_c", "m_d", "m_p", "r", "v"]
+physics_dimension = len(physics_names)
+
+
+def default_config():
+    # same defaults as Polished_bike.py
+    return {
+        "max_iterations": 200,
+        "action_is_theta": True,
+        "maximum_dis": 0.02,
+        "maximum_torque": 2.,
+        "pseudo_batch_size": 10,
+        "num_hidden_units": [24, 24],
+        "trajectory_length": 2,
+        "pseudo_trajectory_length": 10,
+        "try_to_wrap_around_gradients": True,
+        "randomised_goal_position": False,
+        "randomised_state": True,
+        "early_termination": False,
+        "learning_rate": 0.01,
+        "use_tanh": False,
+        "goal": False,
+        "with_psi_restriction": True,
+        "test": "psiRemoved",
+        "xg": 0.,
+        "yg": 60.,
+    }
@@ -0,0 +1,454 @@
+import math
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+from bike_constants import *
+
+# Importable copy of the simulator and policy used by the training scripts.  The scripts configure themselves through
+# argparse and module level globals at import time, so anything that needs the bike from another process (population
+# training, evaluation, tooling) goes through this module instead and passes the experiment settings as a config dict.
+
+
+def chunks(config):
+    # number of trajectory chunks stitched side by side in the batch dimension
+    if config["pseudo_trajectory_length"] <= config["trajectory_length"]:
+        return 1
+    assert config["pseudo_trajectory_length"] % config["trajectory_length"] == 0
+    return config["pseudo_trajectory_length"] // config["trajectory_length"]
+
+
+def batch_size(config):
+    return config["pseudo_batch_size"] * chunks(config)
+
+
+def action_space(config):
+    return 2 if config["action_is_theta"] else 1
+
+
+def run_filename(trial_name, config):
+    # the naming scheme of the runs/ and withClipping/ result files
+    return str(trial_name) + "_with_psi_restriction_" + str(bool(config["with_psi_restriction"])) + \
+        "_randomised_state_" + str(bool(config["randomised_state"])) + "_goal_" + str(bool(config["goal"])) + \
+        "_test_" + str(config["test"]) + "_tanh_" + str(bool(config["use_tanh"]))
+
+
+def reward_weights(config):
+    testt = config["test"]
+    psi_weight = 1. if (config["with_psi_restriction"] and testt != "psiRemoved") else 0.
+    angle_weight = 0. if testt == "angleRemoved" else 1.
+    handle_weight = 0. if testt == "handleRemoved" else 1.
+    return np.array([psi_weight, angle_weight, handle_weight, float(bool(config["use_tanh"])),
+                     float(bool(config["goal"]))], np.float64)
+
+
+def goal_positions(config, n, rng=np.random):
+    # rng is the global NumPy generator by default, or a seeded one from rng_streams.py
+    position = rng.uniform(low=-50, high=50, size=(n, 2)) * (1 if config["randomised_goal_position"] else 0)
+    if not config["randomised_goal_position"]:
+        position += [[config["xg"], config["yg"]]] * n
+    return position.astype(np.float64)
+
+
+def safe_divide(tensor_numerator, tensor_denominator):
+    # attempt to avoid NaN bug in tf.where: https://github.com/tensorflow/tensorflow/issues/2540
+    safe_denominator = tf.where(tf.not_equal(tensor_denominator, tf.zeros_like(tensor_denominator, tf.float64)),
+                                tensor_denominator,
+                                tensor_denominator + 1)
+    return tensor_numerator / safe_denominator
+
+
+def wheelbase(physics=None):
+    # the nominal l, or the (n, 1) per row l of a physics_table()
+    return l if physics is None else np.asarray(physics, np.float64)[:, [physics_names.index("l")]]
+
+
+def reset(config, n, rng=np.random, physics=None):
+    # Lagoudakis (2002) randomizes the initial state "arout the equilibrium position"
+    # with a (n, physics_dimension) physics table the wheels of row i are placed physics[i] l apart
+    length = wheelbase(physics)
+    if config["randomised_state"]:
+        theta = rng.normal(0, 1, size=(n, 1)) * np.pi / 180
+        omega = rng.normal(0, 1, size=(n, 1)) * np.pi / 180
+        xb = rng.uniform(-60, 60, (n, 1))
+        xf = xb + (rng.uniform(0, 1, (n, 1)) * length - 0.5 * length) / 2  # halved it for psi
+    else:
+        theta = omega = xb = xf = np.zeros((n, 1))
+    return initial_states(config, omega, theta, xb, xf, physics)
+
+
+def initial_states(config, omega, theta, xb, xf, physics=None):
+    # builds consistent start states from (n, 1) roll, handle bar and wheel x positions, at rest on y = 0
+    xg = config["xg"]
+    yg = config["yg"]
+    n = np.shape(omega)[0]
+    thetad = omegad = omegadd = yb = np.zeros((n, 1))
+    yf = np.sqrt(wheelbase(physics) ** 2 - (xf - xb) ** 2) + yb
+    psi = np.arctan((xb - xf) / (yf - yb))
+    psig = psi - np.arctan((xb - xg) / np.where(yg - yb != 0, yg - yb, yg - yb + 1))
+    init_state = np.concatenate(
+        [omega, omegad, omegadd, theta, thetad, xf, yf, xb, yb, psi, psig, np.zeros((n, 1))],
+        axis=1).astype(np.float64)
+    # omega, omega_dot, omega_ddot, theta, theta_dot, x_f, y_f, x_b, y_b, psi,psig, timestep
+    return init_state
+
+
+def physics_table(n, spread=0., rng=np.random, columns=None):
+    # (n, physics_dimension) parameters, each listed column scaled by an independent factor in [1 - spread, 1 + spread]
+    nominal = np.array([globals()[name] for name in physics_names], np.float64)
+    table = np.tile(nominal, (n, 1))
+    for i, name in enumerate(physics_names):
+        if columns is None or name in columns:
+            table[:, i] *= 1. + spread * rng.uniform(-1., 1., n)
+    return table
+
+
+def derived_physics(physics=None):
+    # module constants when physics is None, otherwise (batch,) tensors taken from a (batch, physics_dimension) table
+    if physics is None:
+        constants = {name: globals()[name] for name in physics_names}
+    else:
+        physics = tf.cast(physics, tf.float64)
+        constants = {name: physics[:, i] for i, name in enumerate(physics_names)}
+    constants["m"] = constants["m_c"] + constants["m_p"]
+    constants["inertia_bc"] = (13. / 3) * constants["m_c"] * constants["h"] ** 2 + constants["m_p"] * (
+            constants["h"] + constants["d_cm"]) ** 2
+    constants["inertia_dv"] = (3. / 2) * (constants["m_d"] * (constants["r"] ** 2))
+    constants["inertia_dl"] = .5 * (constants["m_d"] * (constants["r"] ** 2))
+    constants["inertia_dc"] = constants["m_d"] * (constants["r"] ** 2)
+    constants["sigma_dot"] = constants["v"] / constants["r"]
+    return constants
+
+
+def flat_bottomed_barrier_function(x, k_width, k_power):
+    return tf.pow(tf.maximum(x / (k_width * 0.5) - 1, 0), k_power)
+
+
+def steering_terms(theta, constants):
+    # handle bar geometry of step(): the lean coupling sign(theta) (m_d r (1 / r_f + 1 / r_b) + m h / r_cm) and the
+    # front and back wheel arc angles asin(v dt / 2 r).  The radii are replaced by a constant exactly at theta == 0.
+    c, h, l, m, m_d, r, v = [constants[name] for name in ["c", "h", "l", "m", "m_d", "r", "v"]]
+    r_f = tf.where(theta == 0., tf.constant(1.e8, tf.float64), safe_divide(l, tf.abs(tf.sin(theta))))
+    r_b = tf.where(theta == 0., tf.constant(1.e8, tf.float64), safe_divide(l, tf.abs(tf.tan(theta))))
+    r_cm = tf.where(theta == 0., tf.constant(1.e8, tf.float64),
+                    tf.sqrt((l - c) ** 2 + (safe_divide(l ** 2, (tf.pow(tf.tan(theta), 2))))))
+    coupling = tf.sign(theta) * (m_d * r * (1.0 / r_f + 1.0 / r_b) + m * h / r_cm)
+    return coupling, tf.asin(v * delta_time / (2. * r_f)), tf.asin(v * delta_time / (2. * r_b))
+
+
+def step(state, action, p_batch_size, config, goal_position, weights, physics=None):
+    # goal_position is (p_batch_size, 2) and weights is (reward_dimension,) or (p_batch_size, reward_dimension), so
+    # rows of one batch can carry different reward settings (see population_bike.py).  physics is an optional
+    # (p_batch_size, physics_dimension) table, see physics_table(); it is a graph input, so new values do not retrace.
+    constants = derived_physics(physics)
+    h, l, m, v = [constants[name] for name in ["h", "l", "m", "v"]]
+    inertia_bc, inertia_dv, inertia_dl, inertia_dc, sigma_dot = [
+        constants[name] for name in ["inertia_bc", "inertia_dv", "inertia_dl", "inertia_dc", "sigma_dot"]]
+    maximum_torque = config["maximum_torque"]
+    maximum_dis = config["maximum_dis"]
+    action = tf.cast(action, tf.float64)
+    s = tf.cast(state, tf.float64)
+    weights = tf.broadcast_to(tf.cast(weights, tf.float64), [p_batch_size, reward_dimension])
+    omega = s[:, 0]
+    omegad = s[:, 1]
+    theta = s[:, 3]
+    thetad = s[:, 4]  # theta - handle bar, omega - angle of bicycle to verticle psi = bikes angle to the yaxis
+    xf = s[:, 5]
+    yf = s[:, 6]
+    xb = s[:, 7]
+    yb = s[:, 8]
+    psi = s[:, 9]
+    timestep = s[:, -1]
+    last_xf = xf
+    last_yf = yf
+    T = action[:, 0] * maximum_torque
+    T = tf.where(T > maximum_torque, tf.ones_like(T) * maximum_torque, T)
+    T = tf.where(T < -maximum_torque, tf.ones_like(T) * -maximum_torque, T)
+    if action_space(config) == 2:
+        d = action[:, 1] * maximum_dis
+        d = tf.where(d > maximum_dis, tf.ones_like(d) * maximum_dis, d)
+        d = tf.where(d < -maximum_dis, tf.ones_like(d) * -maximum_dis, d)
+    else:
+        d = tf.zeros_like(T)
+    if physics is None and config.get("steering_table"):
+        # precomputed tables of the handle bar geometry, see steering_geometry.py
+        from steering_geometry import shared_table
+        coupling, front_arc, back_arc = shared_table(config["steering_table"])(theta)
+    else:
+        coupling, front_arc, back_arc = steering_terms(theta, constants)
+    phi = omega + tf.atan(d / h)
+    # Equations of motion.
+    # --------------------
+    # Second derivative of angular acceleration:
+    omegadd = 1 / inertia_bc * (m * h * gravity * tf.sin(phi)
+                                - tf.cos(phi) * (inertia_dc * sigma_dot * thetad
+                                                 + (v ** 2) * coupling))
+    thetadd = (T - inertia_dv * sigma_dot * omegad) / inertia_dl
+    # Integrate equations of motion using Euler's method.
+    # ---------------------------------------------------
+    # Must update omega based on PREVIOUS value of omegad.
+    df = delta_time
+    omegad += omegadd * df
+    omega += omegad * df
+    thetad += thetadd * df
+    theta += thetad * df
+    # Handlebars can't be turned more than 80 degrees.
+    theta = tf.where(theta > 1.3963, tf.ones_like(theta) * 1.3963, theta)
+    theta = tf.where(theta < -1.3963, tf.ones_like(theta) * -1.3963, theta)
+    # Wheel ('tyre') contact positions.
+    # ---------------------------------
+    # Front wheel contact position.
+    front_term = psi + theta + tf.sign(psi + theta) * front_arc
+    back_term = psi + tf.sign(psi) * back_arc
+    xf += v * df * -tf.sin(front_term)
+    yf += v * df * tf.cos(front_term)
+    xb += v * df * -tf.sin(back_term)
+    yb += v * df * tf.cos(back_term)
+    # Preventing numerical drift.
+    # ---------------------------
+    # Copying what Randlov did.
+    current_wheelbase = tf.sqrt((xf - xb) ** 2 + (yf - yb) ** 2)
+    relative_error = l / current_wheelbase - 1.0
+    xb = tf.where(tf.abs(current_wheelbase - l) > 0.01, xb + (xb - xf) * relative_error, xb)
+    yb = tf.where(tf.abs(current_wheelbase - l) > 0.01, yb + (yb - yf) * relative_error, yb)
+    # Update heading, psi.
+    # --------------------
+    delta_y = yf - yb
+    delta_yg = goal_position[:, 1] - yb
+    psi = tf.where(tf.logical_and(xf == xb, delta_y < 0.0), tf.cast(math.pi, tf.float64),
+                   tf.where((delta_y > 0.0),
+                            tf.atan(safe_divide((xb - xf), delta_y)),
+                            tf.sign(xb - xf) * 0.5 * math.pi - tf.atan(safe_divide(delta_y, (xb - xf)))))
+    psig = tf.where(tf.logical_and(xf == xb, delta_yg < 0.0), psi - math.pi,
+                    tf.where((delta_y > 0.0),
+                             psi - tf.atan(safe_divide((xb - goal_position[:, 0]), delta_yg)),
+                             psi - tf.sign(xb - goal_position[:, 0]) * 0.5 * math.pi - tf.atan(
+                                 safe_divide(delta_yg, (xb - goal_position[:, 0])))))
+    omega = tf.reshape(omega, (p_batch_size, 1))
+    omega = tf.where(tf.abs(omega) > math.pi / 2, tf.cast(math.pi / 2, tf.float64), omega)
+    omega_dot = tf.reshape(omegad, (p_batch_size, 1))
+    omega_ddot = tf.reshape(omegadd, (p_batch_size, 1))
+    theta = tf.reshape(theta, (p_batch_size, 1))
+    theta_dot = tf.reshape(thetad, (p_batch_size, 1))
+    psig = tf.reshape(psig, (p_batch_size, 1))
+    x_d = xf - last_xf
+    y_d = yf - last_yf
+    timestep += 1.
+    x_f = tf.reshape(xf, (p_batch_size, 1))
+    y_f = tf.reshape(yf, (p_batch_size, 1))
+    x_b = tf.reshape(xb, (p_batch_size, 1))
+    y_b = tf.reshape(yb, (p_batch_size, 1))
+    psi = tf.reshape(psi, (p_batch_size, 1))
+    timestep = tf.reshape(timestep, (p_batch_size, 1))
+    trajectories_terminating = timestep >= config["pseudo_trajectory_length"]
+    if config["early_termination"]:
+        trajectories_terminating = tf.logical_or(trajectories_terminating, tf.abs(omega) > crash_angle)
+    trajectories_terminating = tf.reshape(trajectories_terminating, [p_batch_size, ])
+    new_state = tf.concat([omega, omega_dot, omega_ddot, theta, theta_dot, x_f, y_f, x_b, y_b, psi, psig, timestep],
+                          axis=1)
+    # a reward spec in the config is compiled into the graph, otherwise the per-row weights pick the terms
+    reward_function = weighted_reward if config.get("reward_spec") is None else compile_reward(config["reward_spec"])
+    reward = reward_function(new_state, tf.reshape(x_d, (p_batch_size, 1)), tf.reshape(y_d, (p_batch_size, 1)),
+                             goal_position, weights)
+    return [reward, new_state, trajectories_terminating]
+
+
+def goal_progress(new_state, x_d, y_d, goal_position):
+    # distance moved toward the goal this step: the step displacement dotted with the unit vector to the goal
+    goal_displacement = goal_position - new_state[:, 5:7]
+    goal_dist = tf.sqrt(tf.reduce_sum(tf.square(goal_displacement), axis=1, keepdims=True))
+    goal_direction = safe_divide(goal_displacement, goal_dist)  # constructing a unit vector here.
+    return x_d * goal_direction[:, 0:1] + y_d * goal_direction[:, 1:2]
+
+
+def weighted_reward(new_state, x_d, y_d, goal_position, weights):
+    # every term is computed and the (batch, reward_dimension) weights select them row by row, so rows of one batch
+    # can train with different reward settings
+    penalty_handle = flat_bottomed_barrier_function(tf.abs(new_state[:, 3:4]), 1.3963 * 0.9, 8)
+    penalty_angle = flat_bottomed_barrier_function(tf.abs(new_state[:, 0:1]), math.pi / 15, 8)
+    penalty_psi = flat_bottomed_barrier_function(tf.abs(new_state[:, 10:11]), math.pi / 2, 8)
+    penalty = penalty_psi * weights[:, 0:1] + penalty_angle * weights[:, 1:2] + penalty_handle * weights[:, 2:3]
+    r_t = tf.where(weights[:, 4:5] > 0., goal_progress(new_state, x_d, y_d, goal_position), y_d)
+    return -tf.where(weights[:, 3:4] > 0., tf.tanh(penalty), penalty) + r_t
+
+
+def compile_reward(spec):
+    # Builds the reward of a declarative spec (see reward_spec.py) with the same signature as weighted_reward.  It
+    # runs while tracing, so terms with zero weight and the unused goal or tanh branches never become graph ops.
+    terms = [term for term in spec["terms"] if term["weight"] != 0.]
+
+    def reward(new_state, x_d, y_d, goal_position, weights=None):
+        penalty = None
+        for term in terms:
+            column = state_columns.index(term["column"])
+            x = flat_bottomed_barrier_function(tf.abs(new_state[:, column:column + 1]), term["width"], term["power"])
+            if term["weight"] != 1.:
+                x = x * term["weight"]
+            penalty = x if penalty is None else penalty + x
+        r_t = goal_progress(new_state, x_d, y_d, goal_position) if spec["goal"] else y_d
+        if spec["progress_weight"] != 1.:
+            r_t = r_t * spec["progress_weight"]
+        if penalty is None:
+            return r_t
+        return -(tf.tanh(penalty) if spec["tanh"] else penalty) + r_t
+    return reward
+
+
+def evaluate_final_state(state):
+    return tf.zeros_like(state[:, 0])
+
+
+def converter(state, passed_batch_size, weights):
+    # omega, omega_dot, omega_ddot, theta, theta_dot, x_f, y_f, x_b, y_b, psi,psig, timestep
+    weights = tf.broadcast_to(tf.cast(weights, tf.float64), [passed_batch_size, reward_dimension])
+    omega = tf.reshape(state[:, 0], (passed_batch_size, 1))
+    omega_dot = tf.reshape(state[:, 1], (passed_batch_size, 1))
+    theta = tf.reshape(state[:, 3], (passed_batch_size, 1))
+    theta_dot = tf.reshape(state[:, 4], (passed_batch_size, 1))  # theta - handle bar, omega - angle of bicycle to verticle
+    psi = tf.reshape(state[:, 9], (passed_batch_size, 1))
+    psig = tf.reshape(state[:, 10], (passed_batch_size, 1))
+    heading = tf.where(weights[:, 4:5] > 0., psig, psi)
+    omega_visible = tf.tanh(omega * 10)
+    omega_dot = tf.tanh(omega_dot)
+    theta_dot = tf.tanh(theta_dot)
+    theta = tf.tanh(theta / (math.pi / 4))
+    return tf.concat([omega_visible, omega_dot, theta, theta_dot, tf.sin(heading), tf.cos(heading)], axis=1)
+
+
+#MODEL DESIGN
+class model(keras.Model):
+    def __init__(self, num_hidden_units=(24, 24), action_space=2, seed=None):
+        # seed makes the weight initialisation reproducible, each layer gets its own derived seed
+        super(model, self).__init__()
+        self.neural_layers = []
+        for i, hidden in enumerate(num_hidden_units):
+            self.neural_layers.append(keras.layers.Dense(hidden, activation="tanh",
+                                                         kernel_initializer=keras.initializers.RandomNormal(
+                                                             stddev=0.001, seed=None if seed is None else seed + i),
+                                                         bias_initializer=keras.initializers.Zeros()))
+        self.neural_layers.append(keras.layers.Dense(action_space, name='output', activation="tanh",
+                                                     kernel_initializer=keras.initializers.RandomNormal(
+                                                         stddev=0.001,
+                                                         seed=None if seed is None else seed + len(num_hidden_units)),
+                                                     bias_initializer=keras.initializers.Zeros()))
+
+    @tf.function
+    def call(self, input):
+        x = input
+        for layer in self.neural_layers:
+            y = layer(x)
+            x = tf.concat([x, y], axis=1)
+        return y
+
+
+def build_network(config, seed=None):
+    network = model(config["num_hidden_units"], action_space(config), seed)
+    network(tf.zeros((1, observation_dimension), tf.float64))
+    return network
+
+
+def expand_trajectories(policy, start_states, final_artificial_gradient, p_batch_size, config, goal_position, weights,
+                        physics=None):
+    # policy maps the (p_batch_size, observation_dimension) converted state to (p_batch_size, action_space) actions.
+    # Returns the per-row total rewards, callers reduce them.
+    total_rewards = tf.constant(0.0, dtype=tf.float64, shape=[p_batch_size])
+    trajectories_terminated = tf.cast(tf.zeros_like(start_states[:, 0]), tf.bool)
+    state = start_states
+    action_list = []
+    trajectory_list = [state]
+    # build main graph.  This is a long graph with unrolled in time for trajectory_length steps.  Each step includes one neural network followed by one physics-model
+    for t in range(config["trajectory_length"]):
+        converted_state = converter(state, p_batch_size, weights)
+        prevaction = policy(converted_state)
+        action = tf.reshape(prevaction, (p_batch_size, action_space(config)))
+        [rewards, n_state, trajectories_terminating] = step(state, action, p_batch_size, config, goal_position, weights,
+                                                           physics)
+        state = tf.where(tf.expand_dims(trajectories_terminated, 1), state, n_state)
+        action_list.append(prevaction)
+        rewards = tf.reshape(rewards, (p_batch_size,))
+        if t == config["trajectory_length"] - 1:
+            # this is the final step of this trajectory chunk.  If this trajectory chunk feeds into the next trajectory chunk, then feed the gradients through too.
+            correction = tf.reduce_sum((n_state - tf.stop_gradient(n_state)) * final_artificial_gradient,
+                                       axis=1)  # This adds in the gradient that was passed in.  This gradient will have come out of the START of the next trajectory chunk, so it gets added into the END of this current trajectory.
+            rewards += correction
+        total_rewards += tf.where(trajectories_terminated, tf.zeros_like(rewards), rewards)
+        total_rewards += tf.where(tf.logical_and(trajectories_terminating, tf.logical_not(trajectories_terminated)),
+                                  evaluate_final_state(state), tf.zeros_like(rewards))
+        trajectories_terminated = tf.logical_or(trajectories_terminated, trajectories_terminating)
+        trajectory_list.append(state)
+    action_history = tf.stack(action_list, axis=0)
+    trajectory = tf.stack(trajectory_list, axis=0)
+    return [total_rewards, trajectory, action_history, trajectories_terminated]
+
+
+def crashed_chunks(final_state, trajectories_terminated, pseudo_batch_size):
+    # (..., batch - pseudo_batch_size, 1) flags of the chunks whose successor restarts instead of continuing.
+    # A chunk that ended in a non-finite state is restarted like a crash instead of passing the NaNs on.
+    return np.logical_or(trajectories_terminated[..., :-pseudo_batch_size, None],
+                         np.logical_not(np.all(np.isfinite(final_state[..., :-pseudo_batch_size, :]), axis=-1,
+                                               keepdims=True)))
+
+
+def wrap_around(initial_state, initial_state_backup, final_state, trajectories_terminated, d_reward,
+                final_artificial_gradient, pseudo_batch_size, try_to_wrap_around_gradients=True):
+    # Batch layout: row chunk * pseudo_batch_size + k is chunk number "chunk" of trajectory k, so rows of chunk c+1
+    # continue from the end of the same rows of chunk c.  Works on any leading dimensions, (..., batch, 12).
+    # Rows of the first chunk always restart from initial_state_backup.
+    crashed = crashed_chunks(final_state, trajectories_terminated, pseudo_batch_size)
+    initial_state = initial_state.copy()
+    final_artificial_gradient = final_artificial_gradient.copy()
+    # the previous chunk crashed, so the next one needs to start from the beginning, otherwise it starts where the old one left off
+    initial_state[..., pseudo_batch_size:, :] = np.where(crashed, initial_state_backup[..., pseudo_batch_size:, :],
+                                                         final_state[..., :-pseudo_batch_size, :])
+    if try_to_wrap_around_gradients:
+        # feed the gradient that came out of the start of the next chunk into the end of the current one
+        next_gradient = d_reward[..., pseudo_batch_size:, :]
+        final_artificial_gradient[..., :-pseudo_batch_size, :] = np.where(
+            np.logical_or(crashed, np.logical_not(np.isfinite(next_gradient))), 0., next_gradient)
+    return initial_state, final_artificial_gradient
+
+
+def device_wrap_around(initial_state, initial_state_backup, final_state, trajectories_terminated, d_reward,
+                       final_artificial_gradient, pseudo_batch_size, try_to_wrap_around_gradients=True):
+    # wrap_around on tensors, so the stitched start states never leave the device.  Also returns (..., batch) restart
+    # flags, true for the rows whose previous chunk crashed.
+    p = pseudo_batch_size
+    crashed = tf.logical_or(trajectories_terminated[..., :-p, None], tf.logical_not(
+        tf.reduce_all(tf.math.is_finite(final_state[..., :-p, :]), axis=-1, keepdims=True)))
+    initial_state = tf.concat([initial_state[..., :p, :], tf.where(crashed, initial_state_backup[..., p:, :],
+                                                                   final_state[..., :-p, :])], axis=-2)
+    if try_to_wrap_around_gradients:
+        next_gradient = d_reward[..., p:, :]
+        final_artificial_gradient = tf.concat([tf.where(
+            tf.logical_or(crashed, tf.logical_not(tf.math.is_finite(next_gradient))), tf.zeros_like(next_gradient),
+            next_gradient), final_artificial_gradient[..., -p:, :]], axis=-2)
+    restart = tf.concat([tf.zeros_like(trajectories_terminated[..., :p]), crashed[..., 0]], axis=-1)
+    return initial_state, final_artificial_gradient, restart
+
+
+def rollout(policy, start_states, steps, config, goal_position, weights, physics=None, observation=converter):
+    # Evaluation rollout without gradients: steps is a scalar tensor and the loop is a tf.while_loop, so long horizons
+    # are not unrolled into the graph.  Rows stop when they fall past crash_angle and the loop ends once all have.
+    # Returns per row balance steps, crash flags, distance gained toward the goal and the final state.  observation maps
+    # (state, batch, weights) to the policy input, controllers that act on the raw state pass their own.
+    p_batch_size = start_states.shape[0]
+    eval_config = dict(config)
+    eval_config["early_termination"] = True
+    eval_config["pseudo_trajectory_length"] = 1e30  # the loop bound ends the rollout, not the timestep column
+    start_states = tf.cast(start_states, tf.float64)
+    goal_position = tf.cast(goal_position, tf.float64)
+    state = start_states
+    alive = tf.ones([p_batch_size], tf.bool)
+    balance = tf.zeros([p_batch_size], tf.float64)
+    for t in tf.range(steps):
+        if not tf.reduce_any(alive):
+            break
+        action = tf.stop_gradient(policy(observation(state, p_batch_size, weights)))
+        [rewards, n_state, trajectories_terminating] = step(state, action, p_batch_size, eval_config, goal_position,
+                                                            weights, physics)
+        state = tf.where(tf.expand_dims(alive, 1), n_state, state)
+        balance += tf.cast(alive, tf.float64)
+        alive = tf.logical_and(alive, tf.logical_not(trajectories_terminating))
+    crashed = tf.abs(state[:, 0]) > crash_angle
+    start_distance = tf.norm(goal_position - start_states[:, 5:7], axis=1)
+    final_distance = tf.norm(goal_position - state[:, 5:7], axis=1)
+    return balance, crashed, start_distance - final_distance, state
@@ -0,0 +1,91 @@
+import numpy as np
+import tensorflow as tf
+from training_metrics import per_policy_squared_norms
+
+# Gradient clipping for the stacked population update, run inside health_guard's compiled update.  Every mode works
+# per policy, the policies never share a threshold:
+#  - "global"    rescales all gradients of a policy so their joint norm is at most clip_norm
+#  - "per_layer" rescales kernel and bias of every layer separately to at most clip_norm
+#  - "adaptive"  like "global", with a threshold equal to the given percentile of the policy's last `window` finite
+#                gradient norms, kept in a device side ring buffer (no clipping until `warmup` norms were seen)
+# Each call also returns telemetry that stays on the device: the norm before and after clipping, the threshold, the
+# per layer norms and a histogram of log10 |gradient| over all entries.
+modes = ["none", "global", "per_layer", "adaptive"]
+histogram_range = [-12., 4.]  # log10 of the gradient entry magnitude
+histogram_bins = 32
+
+
+class gradient_clipper:
+    def __init__(self, mode, population, n_layers, clip_norm=1., percentile=90., window=100, warmup=10):
+        assert mode in modes, "unknown clipping mode " + str(mode)
+        self.mode = mode
+        self.population = population
+        self.n_layers = n_layers
+        self.clip_norm = clip_norm
+        self.percentile = percentile
+        self.window = window
+        self.warmup = warmup
+        self.history = tf.Variable(tf.zeros([population, window], tf.float64), trainable=False)
+        self.seen = tf.Variable(tf.zeros([population], tf.int64), trainable=False)
+
+    def layer_norms(self, gradients):
+        # gradients are kernels followed by biases, variable i belongs to layer i % n_layers
+        return tf.stack([tf.sqrt(per_policy_squared_norms(gradients[i::self.n_layers]))
+                         for i in range(self.n_layers)], axis=1)
+
+    def adaptive_threshold(self):
+        # percentile of the filled part of each policy's ring buffer, unfilled slots sort to the end as +inf
+        filled = tf.minimum(self.seen, self.window)
+        slots = tf.range(self.window, dtype=tf.int64)[None, :] < filled[:, None]
+        ordered = tf.sort(tf.where(slots, self.history, np.inf), axis=1)
+        index = tf.cast(tf.floor(self.percentile / 100. * tf.cast(tf.maximum(filled - 1, 0), tf.float64)), tf.int64)
+        threshold = tf.gather(ordered, index, batch_dims=1)
+        return tf.where(self.seen >= self.warmup, threshold, np.inf)
+
+    def record(self, norm, ok):
+        slot = self.seen % self.window
+        update = tf.equal(tf.range(self.window, dtype=tf.int64)[None, :], slot[:, None])
+        self.history.assign(tf.where(tf.logical_and(update, ok[:, None]), norm[:, None], self.history))
+        self.seen.assign_add(tf.cast(ok, tf.int64))
+
+    def clip(self, gradients, ok):
+        # gradients stacked (K, ...), ok (K,) marks policies whose gradients are finite and go into the history
+        layer_norms = self.layer_norms(gradients)
+        norm = tf.sqrt(tf.reduce_sum(tf.square(layer_norms), axis=1))
+        threshold = tf.fill([self.population], tf.constant(np.inf, tf.float64))
+        if self.mode == "global":
+            threshold = tf.fill([self.population], tf.constant(self.clip_norm, tf.float64))
+        elif self.mode == "adaptive":
+            threshold = self.adaptive_threshold()
+            self.record(norm, ok)
+        if self.mode == "per_layer":
+            scale = tf.minimum(self.clip_norm / tf.maximum(layer_norms, 1e-30), 1.)
+            clipped = tf.reduce_any(layer_norms > self.clip_norm, axis=1)
+            gradients = [g * tf.cast(tf.reshape(scale[:, i % self.n_layers], [-1] + [1] * (len(g.shape) - 1)), g.dtype)
+                         for i, g in enumerate(gradients)]
+        else:
+            scale = tf.minimum(threshold / tf.maximum(norm, 1e-30), 1.)
+            clipped = norm > threshold
+            gradients = [g * tf.cast(tf.reshape(scale, [-1] + [1] * (len(g.shape) - 1)), g.dtype) for g in gradients]
+        telemetry = {"norm": norm,
+                     "clipped_norm": tf.sqrt(per_policy_squared_norms(gradients)),
+                     "threshold": threshold,
+                     "layer_norms": layer_norms,
+                     "histogram": self.histogram(gradients)}
+        return gradients, clipped, telemetry
+
+    def histogram(self, gradients):
+        # (K, histogram_bins) counts of log10 |g| over every entry of each policy's gradients
+        entries = tf.concat([tf.reshape(tf.cast(g, tf.float64), [self.population, -1]) for g in gradients], axis=1)
+        magnitude = tf.math.log(tf.abs(entries) + 1e-30) / np.log(10.)
+        bins = tf.histogram_fixed_width_bins(magnitude, tf.constant(histogram_range, tf.float64), histogram_bins)
+        offsets = tf.range(self.population)[:, None] * histogram_bins
+        counts = tf.math.bincount(tf.reshape(bins + offsets, [-1]), minlength=self.population * histogram_bins,
+                                  maxlength=self.population * histogram_bins)
+        return tf.reshape(counts, [self.population, histogram_bins])
+
+
+def save_telemetry(path, telemetry):
+    # telemetry is a list of per iteration dicts of device tensors, stacked to (iterations, K, ...) arrays
+    np.savez(path, histogram_edges=np.linspace(histogram_range[0], histogram_range[1], histogram_bins + 1),
+             **{name: np.stack([t[name].numpy() for t in telemetry]) for name in telemetry[0]})
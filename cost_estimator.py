@@ -0,0 +1,117 @@
+import math
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+import bike_core
+
+# Dry run estimate of what a training configuration will cost before launching it.  The learning step is traced for
+# two short probe chunk lengths with the real batch layout.  Op count, tape size and trace time all grow linearly in
+# the unrolled length, so the two probes give a fixed and a per step part of each:
+#  - graph ops, the op count of the traced forward and backward graph
+#  - tape bytes, the summed size of every tensor the forward pass produces, which is what the tape holds for backprop
+#  - step seconds, the median time of a compiled learning step after warm up
+# These are extrapolated to the configured trajectory_length and combined with max_iterations and the logging
+# cadence of population_bike.py into wall time, peak memory and output disk size.
+parser = argparse.ArgumentParser(description='Estimate time, memory and disk of a training run without running it')
+parser.add_argument('--pseudo_batch_size', type=int, default=10)
+parser.add_argument('--trajectory_length', type=int, default=2)
+parser.add_argument('--pseudo_trajectory_length', type=int, default=10)
+parser.add_argument('--num_hidden_units', type=str, default="24,24")
+parser.add_argument('--max_iterations', type=int, default=200)
+parser.add_argument('--population', type=int, default=1)
+parser.add_argument('--log_time', type=int, default=10)
+parser.add_argument('--probe_length', type=int, default=4)
+parser.add_argument('--repeats', type=int, default=5)
+
+
+def tensor_bytes(tensor):
+    if not tensor.shape.is_fully_defined() or tensor.dtype == tf.resource:
+        return 0
+    return int(np.prod(tensor.shape.as_list())) * tensor.dtype.size
+
+
+def probe(config, rows, probe_length, repeats):
+    # trace and time one learning step of probe_length steps with rows bikes
+    probe_config = dict(config, trajectory_length=probe_length)
+    network = bike_core.build_network(probe_config)
+    weights = tf.constant(bike_core.reward_weights(probe_config))
+    goal_position = tf.constant(bike_core.goal_positions(probe_config, rows))
+    start_states = tf.constant(bike_core.reset(probe_config, rows))
+    final_artificial_gradient = tf.zeros_like(start_states)
+
+    def forward(start_states, final_artificial_gradient):
+        return bike_core.expand_trajectories(network, start_states, final_artificial_gradient, rows, probe_config,
+                                             goal_position, weights)[0]
+
+    @tf.function
+    def learn(start_states, final_artificial_gradient):
+        with tf.GradientTape() as tape:
+            tape.watch(start_states)
+            cost_ = -tf.reduce_mean(forward(start_states, final_artificial_gradient))
+        return tape.gradient(cost_, [start_states] + network.trainable_weights)
+
+    start = time.perf_counter()
+    concrete = learn.get_concrete_function(start_states, final_artificial_gradient)
+    trace_seconds = time.perf_counter() - start
+    forward_graph = tf.function(forward).get_concrete_function(start_states, final_artificial_gradient).graph
+    tape_bytes = sum(tensor_bytes(output) for op in forward_graph.get_operations() for output in op.outputs)
+    concrete(start_states, final_artificial_gradient)  # warm up
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        [x.numpy() for x in concrete(start_states, final_artificial_gradient)]
+        seconds.append(time.perf_counter() - start)
+    return {"ops": len(concrete.graph.get_operations()), "tape_bytes": tape_bytes, "trace_seconds": trace_seconds,
+            "step_seconds": float(np.median(seconds))}
+
+
+def extrapolate(short, long, short_length, long_length, length):
+    # linear in the unrolled length through the two probes
+    per_step = max((long - short) / (long_length - short_length), 0.)
+    return max(long + per_step * (length - long_length), 0.)
+
+
+def estimate(config, population=1, log_time=10, probe_length=4, repeats=5):
+    rows = population * bike_core.batch_size(config)
+    length = config["trajectory_length"]
+    short_length = max(1, min(probe_length, length))
+    long_length = 2 * short_length
+    short = probe(config, rows, short_length, repeats)
+    long = probe(config, rows, long_length, repeats)
+    result = {name: extrapolate(short[name], long[name], short_length, long_length, length) for name in short}
+    result["rows"] = rows
+    # weights in float32, Adam keeps two more copies
+    parameters = sum(int(np.prod(w.shape)) for w in bike_core.build_network(config).trainable_weights) * population
+    logs = -(-config["max_iterations"] // log_time)
+    trajectory_bytes = (length + 1) * rows * bike_core.state_dimension * 8
+    result["wall_seconds"] = result["trace_seconds"] + config["max_iterations"] * result["step_seconds"]
+    result["peak_memory_bytes"] = result["tape_bytes"] + 2 * trajectory_bytes + 3 * 4 * parameters
+    # per logging iteration: results and last states per policy, one checkpoint per policy
+    result["disk_bytes"] = logs * (trajectory_bytes + population * (2 * log_time * 8 + 4 * parameters))
+    result["parameters"] = parameters
+    return result
+
+
+def human(value, unit):
+    # SI prefix from log10 of the value, so sub-second step times print as ms / us / ns
+    prefixes = {-3: "n", -2: "u", -1: "m", 0: "", 1: "k", 2: "M", 3: "G", 4: "T", 5: "P"}
+    power = 0 if value == 0 else min(max(int(math.floor(math.log10(abs(value)) / 3)), -3), 5)
+    return "%.1f %s%s" % (value / 1000. ** power, prefixes[power], unit)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    config = bike_core.default_config()
+    config.update(pseudo_batch_size=args.pseudo_batch_size, trajectory_length=args.trajectory_length,
+                  pseudo_trajectory_length=args.pseudo_trajectory_length, max_iterations=args.max_iterations,
+                  num_hidden_units=[int(x) for x in args.num_hidden_units.split(",")])
+    result = estimate(config, args.population, args.log_time, args.probe_length, args.repeats)
+    print("bikes per step:       ", result["rows"])
+    print("graph ops:            ", int(result["ops"]))
+    print("trace time:           ", human(result["trace_seconds"], "s"))
+    print("step time:            ", human(result["step_seconds"], "s"))
+    print("tape memory:          ", human(result["tape_bytes"], "B"))
+    print("estimated wall time:  ", human(result["wall_seconds"], "s"), "(%.2f h)" % (result["wall_seconds"] / 3600.))
+    print("estimated peak memory:", human(result["peak_memory_bytes"], "B"))
+    print("estimated disk output:", human(result["disk_bytes"], "B"))
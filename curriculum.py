@@ -0,0 +1,96 @@
+import numpy as np
+
+# Curriculum over the pseudo trajectory length.  Early in training the policy falls within a few steps, so simulating the
+# full horizon mostly advances frozen rows.  The scheduler starts with a few chunks of trajectory_length and adds chunks
+# once the measured balancing duration (the timestep_history max) fills most of the current horizon.
+#
+# The stitched batch is chunk major (row chunk * pseudo_batch_size + k, see bike_core.wrap_around), so changing the
+# number of chunks only appends or drops whole blocks of rows at the end of the batch.
+
+
+class length_curriculum:
+    def __init__(self, trajectory_length, max_chunks, start_chunks=1, grow_fraction=0.9, patience=3, growth_factor=2,
+                 target_reward=None):
+        self.trajectory_length = trajectory_length
+        self.max_chunks = max_chunks
+        self.chunks = min(start_chunks, max_chunks)
+        self.grow_fraction = grow_fraction
+        self.patience = patience
+        self.growth_factor = growth_factor
+        self.target_reward = target_reward
+        self.streak = 0
+        self.total_time = 0.
+        self.target_time = None
+        self.target_iteration = None
+        # steady state seconds per iteration for each chunk count, the first iteration after a resize is a retrace
+        self.iteration_times = {}
+        self.retracing = True
+        self.history = []
+
+    @property
+    def pseudo_trajectory_length(self):
+        return self.chunks * self.trajectory_length
+
+    def update(self, iteration, max_balance_steps, reward, iteration_time):
+        # returns the number of chunks to use for the next iteration
+        self.total_time += iteration_time
+        if not self.retracing:
+            self.iteration_times.setdefault(self.chunks, []).append(iteration_time)
+        self.retracing = False
+        self.history.append((iteration, self.chunks, max_balance_steps, reward))
+        # rewards are summed over the horizon, so only the full horizon is comparable with a fixed length run
+        if self.target_reward is not None and self.target_time is None and self.chunks == self.max_chunks \
+                and reward >= self.target_reward:
+            self.target_time = self.total_time
+            self.target_iteration = iteration
+        if max_balance_steps >= self.grow_fraction * self.pseudo_trajectory_length:
+            self.streak += 1
+        else:
+            self.streak = 0
+        if self.streak >= self.patience and self.chunks < self.max_chunks:
+            self.chunks = min(self.max_chunks, self.chunks * self.growth_factor)
+            self.streak = 0
+            self.retracing = True
+        return self.chunks
+
+    def seconds_per_iteration(self, chunks):
+        # measured if that length has run, otherwise scaled linearly in horizon from the longest measured length
+        if chunks in self.iteration_times:
+            return float(np.median(self.iteration_times[chunks]))
+        if not self.iteration_times:
+            return None
+        measured = max(self.iteration_times)
+        return float(np.median(self.iteration_times[measured])) * chunks / measured
+
+    def summary(self):
+        # curriculum_seconds is measured.  The fixed length figures are estimates, not a fixed length run: the full
+        # horizon seconds per iteration (measured, or scaled from a shorter horizon) times the iterations this run
+        # took, assuming a fixed length run needs as many iterations to reach the target.
+        fixed = self.seconds_per_iteration(self.max_chunks)
+        report = {"target_reward": self.target_reward, "target_iteration": self.target_iteration,
+                  "curriculum_seconds": self.target_time, "estimated_fixed_length_seconds": None,
+                  "estimated_seconds_saved": None}
+        if self.target_iteration is not None and fixed is not None:
+            report["estimated_fixed_length_seconds"] = fixed * (self.target_iteration + 1)
+            report["estimated_seconds_saved"] = report["estimated_fixed_length_seconds"] - self.target_time
+        return report
+
+
+def resize_stitching_buffers(initial_state, initial_state_backup, final_artificial_gradient, pseudo_batch_size,
+                             new_chunks, fresh_states):
+    # fresh_states (..., new rows, 12) seed the appended chunks; they are replaced by the end states of the chunk before
+    # them on the next wrap-around.  Arrays may carry leading dimensions, e.g. (K, batch, 12).
+    rows = new_chunks * pseudo_batch_size
+    old_rows = initial_state.shape[-2]
+    if rows <= old_rows:
+        initial_state = initial_state[..., :rows, :].copy()
+        initial_state_backup = initial_state_backup[..., :rows, :].copy()
+        final_artificial_gradient = final_artificial_gradient[..., :rows, :].copy()
+        # the new last chunk has nothing after it to take gradients from
+        final_artificial_gradient[..., rows - pseudo_batch_size:, :] = 0.
+        return initial_state, initial_state_backup, final_artificial_gradient
+    fresh_states = fresh_states[..., :rows - old_rows, :]
+    initial_state = np.concatenate([initial_state, fresh_states], axis=-2)
+    initial_state_backup = np.concatenate([initial_state_backup, fresh_states], axis=-2)
+    final_artificial_gradient = np.concatenate([final_artificial_gradient, np.zeros_like(fresh_states)], axis=-2)
+    return initial_state, initial_state_backup, final_artificial_gradient
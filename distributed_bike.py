@@ -0,0 +1,172 @@
+import os
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+import bike_core
+from rng_streams import trial_streams, enable_determinism
+
+# Data parallel training of one policy across several logical CPU devices on one host with tf.distribute.  The
+# stitched batch is split by trajectory: every replica gets pseudo_batch_size / N whole trajectories with all of their
+# chunks, laid out chunk major exactly like the full batch.  So no chunk chain crosses a shard boundary, and the host
+# wrap-around sees the same global batch as the single device trainer.  Gradients are summed across replicas
+# synchronously by the optimizer.
+parser = argparse.ArgumentParser(description='Data parallel bike training across CPU devices')
+parser.add_argument('--trialname', type=str, default="trial_1")
+parser.add_argument('--workers', type=int, default=2)
+parser.add_argument('--pseudo_batch_size', type=int, default=64)
+parser.add_argument('--iterations', type=int, default=200)
+parser.add_argument('--benchmark', type=int, default=0)
+parser.add_argument('--benchmark_iterations', type=int, default=20)
+# without --seed the start states, goals and weights come from the global generators as before
+parser.add_argument('--seed', type=int, default=None)
+
+
+def configure_cpu_devices(workers):
+    # must run before TensorFlow initialises its devices
+    cpus = tf.config.list_physical_devices('CPU')
+    tf.config.set_logical_device_configuration(cpus[0], [tf.config.LogicalDeviceConfiguration()] * workers)
+    return ["/cpu:" + str(i) for i in range(workers)]
+
+
+def shard(array, replicas, pseudo_batch_size, axis=0):
+    # chunk major (..., chunks * pseudo_batch_size, ...) -> one chunk major block of whole trajectories per replica
+    array = np.moveaxis(array, axis, 0)
+    per_replica = pseudo_batch_size // replicas
+    blocks = array.reshape((-1, replicas, per_replica) + array.shape[1:])
+    return [np.moveaxis(blocks[:, i].reshape((-1,) + array.shape[1:]), 0, axis) for i in range(replicas)]
+
+
+def unshard(shards, pseudo_batch_size, axis=0):
+    replicas = len(shards)
+    per_replica = pseudo_batch_size // replicas
+    shards = [np.moveaxis(np.asarray(x), axis, 0) for x in shards]
+    blocks = np.stack([x.reshape((-1, per_replica) + x.shape[1:]) for x in shards], axis=1)
+    return np.moveaxis(blocks.reshape((-1,) + shards[0].shape[1:]), 0, axis)
+
+
+def trajectory_goals(config):
+    # one goal per trajectory, repeated for each of its chunks
+    return np.tile(bike_core.goal_positions(config, config["pseudo_batch_size"]), (bike_core.chunks(config), 1))
+
+
+def seeded_inputs(config, streams, replicas):
+    # start states and goals of every replica's trajectories from that worker's own streams, so no two workers draw
+    # the same numbers.  The global batch therefore depends on the number of replicas.
+    per_replica = config["pseudo_batch_size"] // replicas
+    chunks = bike_core.chunks(config)
+    states, goals = [], []
+    for replica in range(replicas):
+        worker = streams.worker_streams(replica)
+        states.append(bike_core.reset(config, per_replica * chunks, worker.numpy("states")))
+        goals.append(np.tile(bike_core.goal_positions(config, per_replica, worker.numpy("goals")), (chunks, 1)))
+    return unshard(states, config["pseudo_batch_size"]), unshard(goals, config["pseudo_batch_size"])
+
+
+class data_parallel_trainer:
+    def __init__(self, devices, config, seed=None):
+        self.config = config
+        self.replicas = len(devices)
+        assert config["pseudo_batch_size"] % self.replicas == 0, "pseudo_batch_size must split evenly over workers"
+        self.strategy = tf.distribute.MirroredStrategy(devices=devices,
+                                                       cross_device_ops=tf.distribute.ReductionToOneDevice())
+        self.batch_size = bike_core.batch_size(config)
+        self.local_rows = self.batch_size // self.replicas
+        with self.strategy.scope():
+            self.network = bike_core.build_network(config, seed)
+            self.opt = keras.optimizers.Adam(config["learning_rate"])
+        self.weights = tf.constant(bike_core.reward_weights(config))
+        self.train_step = tf.function(self.distributed_step)
+
+    def distribute(self, array):
+        shards = [tf.constant(x) for x in shard(array, self.replicas, self.config["pseudo_batch_size"])]
+        return self.strategy.experimental_distribute_values_from_function(
+            lambda context: shards[context.replica_id_in_sync_group])
+
+    def replica_step(self, start_states, final_artificial_gradient, goal_position):
+        with tf.GradientTape() as tape:
+            tape.watch(start_states)
+            [total_rewards, trajectory, actions, trajectories_terminated] = bike_core.expand_trajectories(
+                self.network, start_states, final_artificial_gradient, self.local_rows, self.config, goal_position,
+                self.weights)
+            # mean over the global batch, the optimizer sums the replica gradients
+            cost_ = -tf.reduce_sum(total_rewards) / self.batch_size
+        grads = tape.gradient(cost_, [start_states] + self.network.trainable_weights)
+        self.opt.apply_gradients(zip(grads[1:], self.network.trainable_weights))
+        dReward_dInputState = -grads[0] * self.batch_size
+        return dReward_dInputState, trajectory, total_rewards, trajectories_terminated
+
+    def distributed_step(self, start_states, final_artificial_gradient, goal_position):
+        return self.strategy.run(self.replica_step, args=(start_states, final_artificial_gradient, goal_position))
+
+    def learn(self, initial_state, final_artificial_gradient, goal_position):
+        # global numpy arrays in, global numpy arrays out in the usual chunk major order
+        outputs = self.train_step(self.distribute(initial_state), self.distribute(final_artificial_gradient),
+                                  self.distribute(goal_position))
+        pseudo_batch_size = self.config["pseudo_batch_size"]
+        local = [[x.numpy() for x in self.strategy.experimental_local_results(output)] for output in outputs]
+        dReward_dInputState = unshard(local[0], pseudo_batch_size)
+        trajectory = unshard(local[1], pseudo_batch_size, axis=1)
+        total_rewards = unshard(local[2], pseudo_batch_size)
+        trajectories_terminated = unshard(local[3], pseudo_batch_size)
+        return dReward_dInputState, trajectory, total_rewards, trajectories_terminated
+
+
+def train(trainer, iterations, initial_state, goal_position, verbose=True):
+    config = trainer.config
+    initial_state_backup = initial_state.copy()
+    final_artificial_gradient = np.zeros_like(initial_state)
+    seconds = []
+    for iteration in range(iterations):
+        iteration_start = time.perf_counter()
+        dReward_dInputState, trajectory, total_rewards, trajectories_terminated = trainer.learn(
+            initial_state, final_artificial_gradient, goal_position)
+        initial_state, final_artificial_gradient = bike_core.wrap_around(
+            initial_state, initial_state_backup, trajectory[-1], trajectories_terminated, dReward_dInputState,
+            final_artificial_gradient, config["pseudo_batch_size"], config["try_to_wrap_around_gradients"])
+        seconds.append(time.perf_counter() - iteration_start)
+        if verbose:
+            print("iteration: ", iteration, "// max reward: ", np.max(total_rewards), "max steps: ",
+                  np.max(trajectory[:, :, -1]), "seconds: ", seconds[-1])
+    return seconds
+
+
+def scaling_report(workers, config, iterations):
+    # strong scaling: the same global batch on 1..N devices, the first iteration (tracing) is left out
+    initial_state = bike_core.reset(config, bike_core.batch_size(config))
+    goal_position = trajectory_goals(config)
+    steps = bike_core.batch_size(config) * config["trajectory_length"]
+    baseline = None
+    print("workers  seconds/iter  bike-steps/sec  efficiency")
+    for n in range(1, workers + 1):
+        if config["pseudo_batch_size"] % n:
+            continue
+        trainer = data_parallel_trainer(["/cpu:" + str(i) for i in range(n)], config, seed=0)
+        seconds = float(np.median(train(trainer, iterations + 1, initial_state, goal_position, verbose=False)[1:]))
+        baseline = seconds if baseline is None else baseline
+        print("%7d  %12.4f  %14.0f  %10.2f" % (n, seconds, steps / seconds, baseline / (n * seconds)))
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    devices = configure_cpu_devices(args.workers)
+    config = bike_core.default_config()
+    config["pseudo_batch_size"] = args.pseudo_batch_size
+    config["max_iterations"] = args.iterations
+    if args.benchmark:
+        scaling_report(args.workers, config, args.benchmark_iterations)
+    else:
+        if args.seed is None:
+            trainer = data_parallel_trainer(devices, config)
+            initial_state = bike_core.reset(config, bike_core.batch_size(config))
+            goal_position = trajectory_goals(config)
+        else:
+            enable_determinism()
+            streams = trial_streams(args.seed, args.trialname)
+            # the replicas mirror one network, so its weights come from the trial's stream
+            trainer = data_parallel_trainer(devices, config, streams.seed_for("weights"))
+            initial_state, goal_position = seeded_inputs(config, streams, len(devices))
+        train(trainer, config["max_iterations"], initial_state, goal_position)
+        os.makedirs("checkpoints", exist_ok=True)
+        trainer.network.save_weights("./checkpoints/my_checkpoint_" + args.trialname + "_data_parallel")
@@ -0,0 +1,99 @@
+import os
+import csv
+import glob
+import argparse
+import multiprocessing
+import numpy as np
+
+# Leaderboard of every checkpoint in a directory.  Each checkpoint is rolled out from the same seeded bank of start
+# states with a compiled, gradient free rollout (bike_core.rollout) in large batches.  Checkpoints are spread over
+# worker processes, each with its own TensorFlow runtime and a share of the CPU threads.
+parser = argparse.ArgumentParser(description='Evaluate and rank every checkpoint in a directory')
+parser.add_argument('--checkpoints', type=str, default="checkpoints")
+parser.add_argument('--bank', type=str, default="banks/evaluation_states.npy")
+parser.add_argument('--states', type=int, default=4096)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--steps', type=int, default=1000)
+parser.add_argument('--batch', type=int, default=1024)
+parser.add_argument('--goal', type=int, default=0)
+parser.add_argument('--workers', type=int, default=max(1, multiprocessing.cpu_count() // 2))
+parser.add_argument('--output', type=str, default="leaderboard.csv")
+columns = ["checkpoint", "mean_balance_steps", "median_balance_steps", "crash_rate", "mean_goal_progress"]
+
+
+def find_checkpoints(directory):
+    # TF checkpoints are a prefix with a .index file next to the data shards
+    return sorted(path[:-len(".index")] for path in glob.glob(os.path.join(directory, "*.index")))
+
+
+def evaluate_checkpoint(job):
+    # runs in a worker process, so TensorFlow is imported and configured here
+    prefix, bank_path, steps, batch, goal, threads = job
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    import bike_core
+    from state_bank import open_bank
+    config = bike_core.default_config()
+    config["goal"] = bool(goal)
+    network = bike_core.build_network(config)
+    network.load_weights(prefix).expect_partial()
+    weights = tf.constant(bike_core.reward_weights(config))
+    goal_position = tf.constant(np.tile([[config["xg"], config["yg"]]], (batch, 1)))
+
+    @tf.function(input_signature=[tf.TensorSpec([batch, bike_core.state_dimension], tf.float64)])
+    def evaluate(start_states):
+        return bike_core.rollout(network, start_states, tf.constant(steps), config, goal_position, weights)[:3]
+
+    bank = open_bank(bank_path)
+    balance, crashed, progress = [], [], []
+    for start in range(0, bank.shape[0], batch):
+        states = np.array(bank[start:start + batch])
+        n = states.shape[0]
+        if n < batch:
+            # pad the last batch so the compiled rollout keeps one shape
+            states = np.concatenate([states, np.repeat(states[-1:], batch - n, axis=0)])
+        results = [x.numpy()[:n] for x in evaluate(tf.constant(states))]
+        balance.append(results[0])
+        crashed.append(results[1])
+        progress.append(results[2])
+    balance = np.concatenate(balance)
+    return {"checkpoint": os.path.basename(prefix),
+            "mean_balance_steps": float(np.mean(balance)),
+            "median_balance_steps": float(np.median(balance)),
+            "crash_rate": float(np.mean(np.concatenate(crashed))),
+            "mean_goal_progress": float(np.mean(np.concatenate(progress)))}
+
+
+def leaderboard(results):
+    # longest balance first, then fewest crashes, then most progress toward the goal
+    return sorted(results, key=lambda row: (-row["mean_balance_steps"], row["crash_rate"], -row["mean_goal_progress"]))
+
+
+def write_leaderboard(path, rows):
+    with open(path, "w", newline="") as output:
+        writer = csv.DictWriter(output, fieldnames=["rank"] + columns)
+        writer.writeheader()
+        for rank, row in enumerate(rows, 1):
+            writer.writerow(dict(row, rank=rank))
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if not os.path.exists(args.bank):
+        # the bank is built once, later evaluations reuse exactly the same start states
+        import bike_core
+        from state_bank import write_bank
+        os.makedirs(os.path.dirname(args.bank) or ".", exist_ok=True)
+        write_bank(args.bank, bike_core.default_config(), args.states, "stratified", args.seed)
+    checkpoints = find_checkpoints(args.checkpoints)
+    workers = max(1, min(args.workers, len(checkpoints)))
+    threads = max(1, multiprocessing.cpu_count() // workers)
+    jobs = [(prefix, args.bank, args.steps, args.batch, args.goal, threads) for prefix in checkpoints]
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        rows = leaderboard(pool.map(evaluate_checkpoint, jobs))
+    write_leaderboard(args.output, rows)
+    print("%4s  %-40s %12s %10s %12s" % ("rank", "checkpoint", "balance", "crash rate", "goal progress"))
+    for rank, row in enumerate(rows, 1):
+        print("%4d  %-40s %12.1f %10.3f %12.2f" % (rank, row["checkpoint"], row["mean_balance_steps"],
+                                                  row["crash_rate"], row["mean_goal_progress"]))
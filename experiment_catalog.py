@@ -0,0 +1,194 @@
+import os
+import re
+import time
+import sqlite3
+import argparse
+import numpy as np
+
+# SQLite catalog of stored results.  Every payload file (.npy results, histories and last states, clipping telemetry,
+# trajectory archives) gets one row holding the config flags parsed from its run_filename style name, the folder it
+# lives in (withClipping/ and withoutClipping/ also give the clipping flag), the trial, the marker iteration, and for
+# .npy files the byte offset, dtype and shape of the array data, so a reader can memory map the payload directly.
+# The trainer adds files as it writes them, together with the seed and code version; scan() backfills existing folders.
+# "All tanh=True, randomised_state=True runs at iteration >= 500" is then one indexed query:
+#   query(connection, use_tanh=1, randomised_state=1, min_marker=500)
+schema = """
+create table if not exists payloads (
+    path text primary key,
+    folder text,
+    kind text,
+    trial text,
+    policy integer,
+    marker integer,
+    with_psi_restriction integer,
+    randomised_state integer,
+    goal integer,
+    test text,
+    use_tanh integer,
+    clipping integer,
+    seed integer,
+    code_version text,
+    payload_offset integer,
+    payload_bytes integer,
+    dtype text,
+    shape text,
+    mtime real
+);
+create index if not exists payload_flags on payloads (use_tanh, randomised_state, with_psi_restriction, goal, test,
+                                                    marker);
+create index if not exists payload_trial on payloads (trial, marker);
+create index if not exists payload_kind on payloads (kind, marker);
+"""
+flag_columns = ["with_psi_restriction", "randomised_state", "goal", "test", "use_tanh", "clipping", "seed", "trial",
+                "policy", "kind", "folder", "code_version"]
+# bike_core.run_filename, optionally behind "<trial>_marker_<n>_<kind>_" or "last_state_"
+run_pattern = re.compile(r"(?P<name>.+?)_with_psi_restriction_(?P<with_psi_restriction>True|False)"
+                         r"_randomised_state_(?P<randomised_state>True|False)_goal_(?P<goal>True|False)"
+                         r"_test_(?P<test>.+?)_tanh_(?P<use_tanh>True|False)$")
+kinds = "results|action_history|trajectory_history|gradient_norms"
+marker_pattern = re.compile(r"(?P<trial>.+?)_marker_(?P<marker>\d+)_(?P<kind>" + kinds + r")_(?P<rest>.+)$")
+archive_pattern = re.compile(r"(?P<trial>.+?)_trajectories_(?P<rest>.+)$")
+extensions = [".npy", ".npz", ".zip"]
+
+
+def connect(path="catalog.sqlite"):
+    # the trainer writes from its background writer thread
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.executescript(schema)
+    return connection
+
+
+def parse_name(filename):
+    # config flags and marker from a result file name, missing parts stay None
+    stem, extension = os.path.splitext(os.path.basename(filename))
+    row = {"kind": "other", "trial": None, "marker": None, "policy": None}
+    match = marker_pattern.match(stem)
+    if match:
+        row.update(trial=match.group("trial"), marker=int(match.group("marker")), kind=match.group("kind"))
+        stem = match.group("rest")
+    elif stem.startswith("last_state_"):
+        row["kind"] = "last_state"
+        stem = stem[len("last_state_"):]
+    elif extension == ".zip" and archive_pattern.match(stem):
+        match = archive_pattern.match(stem)
+        row.update(trial=match.group("trial"), kind="trajectories")
+        stem = match.group("rest")
+    match = run_pattern.match(stem)
+    if match:
+        name = match.group("name")
+        policy = re.match(r"(.+)_policy_(\d+)$", name)
+        if policy:
+            name, row["policy"] = policy.group(1), int(policy.group(2))
+        row["trial"] = row["trial"] or name
+        for flag in ["with_psi_restriction", "randomised_state", "goal", "use_tanh"]:
+            row[flag] = int(match.group(flag) == "True")
+        row["test"] = match.group("test")
+    return row
+
+
+def folder_clipping(folder):
+    name = os.path.basename(os.path.normpath(folder)).lower()
+    if name == "withclipping":
+        return 1
+    if name == "withoutclipping":
+        return 0
+    return None
+
+
+def payload_location(path):
+    # byte offset, size, dtype and shape of the array data of a .npy file
+    with open(path, "rb") as source:
+        version = np.lib.format.read_magic(source)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(source)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(source)
+        offset = source.tell()
+    if dtype.hasobject or fortran_order:
+        # pickled objects have no fixed layout to map, Fortran order would be mapped transposed, both go via np.load
+        return None, None, dtype.str, ",".join(str(x) for x in shape)
+    return offset, os.path.getsize(path) - offset, dtype.str, ",".join(str(x) for x in shape)
+
+
+def add(connection, path, commit=True, **extra):
+    # one file, flags from its name and folder, extra columns (seed, code_version, clipping) from the caller
+    row = parse_name(path)
+    folder = os.path.dirname(os.path.abspath(path))
+    row.update(path=os.path.abspath(path), folder=os.path.basename(folder), clipping=folder_clipping(folder),
+               mtime=os.path.getmtime(path))
+    if path.endswith(".npy"):
+        row["payload_offset"], row["payload_bytes"], row["dtype"], row["shape"] = payload_location(path)
+    row.update({key: value for key, value in extra.items() if value is not None})
+    columns = sorted(row)
+    connection.execute("insert or replace into payloads (" + ",".join(columns) + ") values (" +
+                       ",".join("?" * len(columns)) + ")", [row[column] for column in columns])
+    if commit:
+        connection.commit()
+
+
+def scan(connection, folders):
+    # backfill: add every payload file below the folders that is new or changed since it was catalogued
+    known = dict(connection.execute("select path, mtime from payloads"))
+    added = 0
+    for folder in folders:
+        for root, _, files in os.walk(folder):
+            for filename in files:
+                path = os.path.abspath(os.path.join(root, filename))
+                if os.path.splitext(filename)[1] in extensions and known.get(path) != os.path.getmtime(path):
+                    add(connection, path, commit=False)
+                    added += 1
+    connection.commit()
+    return added
+
+
+def query(connection, min_marker=None, max_marker=None, **flags):
+    # rows as dicts, flags are equality filters on the catalog columns
+    conditions, values = [], []
+    for flag, value in flags.items():
+        assert flag in flag_columns, "unknown catalog column " + flag
+        if value is not None:
+            conditions.append(flag + " = ?")
+            values.append(value)
+    if min_marker is not None:
+        conditions.append("marker >= ?")
+        values.append(min_marker)
+    if max_marker is not None:
+        conditions.append("marker <= ?")
+        values.append(max_marker)
+    where = " where " + " and ".join(conditions) if conditions else ""
+    cursor = connection.execute("select * from payloads" + where + " order by trial, marker", values)
+    names = [column[0] for column in cursor.description]
+    return [dict(zip(names, row)) for row in cursor]
+
+
+def load_payload(row):
+    # memory mapped array of a catalogued .npy file straight from its recorded offset, object arrays are unpickled
+    if row["payload_offset"] is None:
+        return np.load(row["path"], allow_pickle=True)
+    shape = tuple(int(x) for x in row["shape"].split(",") if x)
+    return np.memmap(row["path"], dtype=np.dtype(row["dtype"]), mode="r", offset=row["payload_offset"], shape=shape)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Index stored results in an SQLite catalog and query it')
+    parser.add_argument('command', choices=["scan", "query"])
+    parser.add_argument('folders', nargs='*', default=["withClipping", "withoutClipping", "trials", "runs"])
+    parser.add_argument('--catalog', type=str, default="catalog.sqlite")
+    parser.add_argument('--min_marker', type=int, default=None)
+    parser.add_argument('--max_marker', type=int, default=None)
+    for flag in ["with_psi_restriction", "randomised_state", "goal", "use_tanh", "clipping", "seed", "policy"]:
+        parser.add_argument('--' + flag, type=int, default=None)
+    for flag in ["test", "trial", "kind"]:
+        parser.add_argument('--' + flag, type=str, default=None)
+    args = parser.parse_args()
+    connection = connect(args.catalog)
+    start = time.perf_counter()
+    if args.command == "scan":
+        print("catalogued", scan(connection, args.folders), "files in %.2fs" % (time.perf_counter() - start))
+    else:
+        flags = {flag: getattr(args, flag) for flag in ["with_psi_restriction", "randomised_state", "goal", "use_tanh",
+                                                       "clipping", "seed", "policy", "test", "trial", "kind"]}
+        rows = query(connection, args.min_marker, args.max_marker, **flags)
+        for row in rows:
+            print(row["marker"], row["kind"], row["path"])
+        print(len(rows), "rows in %.1f ms" % (1000 * (time.perf_counter() - start)))
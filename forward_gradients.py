@@ -0,0 +1,185 @@
+import sys
+import json
+import time
+import resource
+import argparse
+import subprocess
+import numpy as np
+import tensorflow as tf
+import bike_core
+
+# Memory light alternative to the reverse mode tape of the learning step.
+#  - forward_state_gradients gets d(chunk reward)/d(chunk start state), the 12 numbers per row that the wrap-around
+#    feeds back, with tf.autodiff.ForwardAccumulator.  The batch is tiled once per state direction and the tangents
+#    are pushed through a tf.while_loop one step at a time, so memory does not grow with trajectory_length (the price
+#    is 12 forward passes worth of compute).
+#  - checkpointed_weight_gradients gets the weight gradient in reverse mode, but every `segment` steps are wrapped in
+#    tf.recompute_grad, so the tape only keeps the segment boundaries and recomputes the inside on the way back.
+# Both follow bike_core.expand_trajectories exactly: frozen rows after termination, the final_artificial_gradient
+# correction on the last step.  --mode compare runs the tape and the forward path in separate processes and reports
+# time, peak resident memory and the difference of the gradients.
+parser = argparse.ArgumentParser(description='Forward mode wrap-around gradients and tape comparison')
+parser.add_argument('--pseudo_batch_size', type=int, default=10)
+parser.add_argument('--trajectory_length', type=int, default=100)
+parser.add_argument('--pseudo_trajectory_length', type=int, default=1000)
+parser.add_argument('--segment', type=int, default=10)
+parser.add_argument('--repeats', type=int, default=5)
+parser.add_argument('--mode', type=str, default="compare", choices=["compare", "tape", "forward", "check"])
+
+
+def tile_rows(x, copies, rows):
+    return tf.tile(tf.broadcast_to(tf.cast(x, tf.float64), [rows, x.shape[-1]]), [copies, 1])
+
+
+def forward_state_gradients(policy, start_states, final_artificial_gradient, p_batch_size, config, goal_position,
+                            weights, physics=None):
+    # returns per row total rewards, d_reward/d_start_state (batch, 12), the final state and the terminated flags
+    n = bike_core.state_dimension
+    rows = n * p_batch_size
+    # row j * batch + b is bike b with tangent along state direction j
+    state = tf.tile(tf.cast(start_states, tf.float64), [n, 1])
+    tangent = tf.repeat(tf.eye(n, dtype=tf.float64), p_batch_size, axis=0)
+    goal_position = tile_rows(goal_position, n, p_batch_size)
+    weights = tile_rows(weights, n, p_batch_size)
+    physics = None if physics is None else tile_rows(physics, n, p_batch_size)
+    final_artificial_gradient = tile_rows(final_artificial_gradient, n, p_batch_size)
+    terminated = tf.zeros([rows], tf.bool)
+    total_rewards = tf.zeros([rows], tf.float64)
+    d_rewards = tf.zeros([rows], tf.float64)
+    last = config["trajectory_length"] - 1
+    for t in tf.range(config["trajectory_length"]):
+        with tf.autodiff.ForwardAccumulator(state, tangent) as accumulator:
+            action = tf.reshape(policy(bike_core.converter(state, rows, weights)),
+                                (rows, bike_core.action_space(config)))
+            [rewards, n_state, trajectories_terminating] = bike_core.step(state, action, rows, config, goal_position,
+                                                                          weights, physics)
+            rewards = tf.reshape(rewards, (rows,))
+            correction = tf.reduce_sum((n_state - tf.stop_gradient(n_state)) * final_artificial_gradient, axis=1)
+            rewards += tf.where(t == last, correction, tf.zeros_like(correction))
+            rewards = tf.where(terminated, tf.zeros_like(rewards), rewards)
+            n_state = tf.where(tf.expand_dims(terminated, 1), state, n_state)
+        d_rewards += accumulator.jvp(rewards, unconnected_gradients=tf.UnconnectedGradients.ZERO)
+        tangent = accumulator.jvp(n_state, unconnected_gradients=tf.UnconnectedGradients.ZERO)
+        total_rewards += rewards
+        terminated = tf.logical_or(terminated, trajectories_terminating)
+        state = n_state
+    d_reward_d_state = tf.transpose(tf.reshape(d_rewards, [n, p_batch_size]))
+    return total_rewards[:p_batch_size], d_reward_d_state, state[:p_batch_size], terminated[:p_batch_size]
+
+
+def checkpointed_rewards(policy, start_states, final_artificial_gradient, p_batch_size, config, goal_position,
+                         weights, physics=None, segment=10):
+    # per row total rewards, with only the segment boundaries kept for the backward pass
+    length = config["trajectory_length"]
+
+    def make_segment(steps, final):
+        def run(state, alive):
+            total = tf.zeros([p_batch_size], tf.float64)
+            for i in range(steps):
+                action = tf.reshape(policy(bike_core.converter(state, p_batch_size, weights)),
+                                    (p_batch_size, bike_core.action_space(config)))
+                [rewards, n_state, trajectories_terminating] = bike_core.step(state, action, p_batch_size, config,
+                                                                              goal_position, weights, physics)
+                rewards = tf.reshape(rewards, (p_batch_size,))
+                if final and i == steps - 1:
+                    rewards += tf.reduce_sum((n_state - tf.stop_gradient(n_state)) * final_artificial_gradient, axis=1)
+                total += alive * rewards
+                state = tf.where(tf.expand_dims(alive > 0., 1), n_state, state)
+                alive = alive * (1. - tf.cast(trajectories_terminating, tf.float64))
+            return state, alive, total
+        return tf.recompute_grad(run)
+
+    state = tf.cast(start_states, tf.float64)
+    alive = tf.ones([p_batch_size], tf.float64)
+    total_rewards = tf.zeros([p_batch_size], tf.float64)
+    for start in range(0, length, segment):
+        steps = min(segment, length - start)
+        state, alive, total = make_segment(steps, start + steps == length)(state, alive)
+        total_rewards += total
+    return total_rewards
+
+
+def checkpointed_weight_gradients(network, start_states, final_artificial_gradient, p_batch_size, config,
+                                  goal_position, weights, physics=None, segment=10):
+    with tf.GradientTape() as tape:
+        total_rewards = checkpointed_rewards(network, start_states, final_artificial_gradient, p_batch_size, config,
+                                             goal_position, weights, physics, segment)
+        cost_ = -tf.reduce_mean(total_rewards)
+    return tape.gradient(cost_, network.trainable_weights)
+
+
+def learning_steps(config, segment):
+    # the tape learning step of the trainers and its forward mode counterpart, both (weight grads, d_reward/d_state)
+    batch_size = bike_core.batch_size(config)
+    network = bike_core.build_network(config, seed=0)
+    weights = tf.constant(bike_core.reward_weights(config))
+    goal_position = tf.constant(bike_core.goal_positions(config, batch_size))
+
+    @tf.function
+    def tape_step(start_states, final_artificial_gradient):
+        with tf.GradientTape() as tape:
+            tape.watch(start_states)
+            total_rewards = bike_core.expand_trajectories(network, start_states, final_artificial_gradient, batch_size,
+                                                          config, goal_position, weights)[0]
+            cost_ = -tf.reduce_mean(total_rewards)
+        grads = tape.gradient(cost_, [start_states] + network.trainable_weights)
+        return grads[1:], -grads[0] * batch_size
+
+    @tf.function
+    def forward_step(start_states, final_artificial_gradient):
+        d_reward = forward_state_gradients(network, start_states, final_artificial_gradient, batch_size, config,
+                                           goal_position, weights)[1]
+        grads = checkpointed_weight_gradients(network, start_states, final_artificial_gradient, batch_size, config,
+                                              goal_position, weights, segment=segment)
+        return grads, d_reward
+    return {"tape": tape_step, "forward": forward_step}
+
+
+def measure(config, mode, segment, repeats):
+    # runs in its own process so the peak resident memory belongs to one mode only
+    step = learning_steps(config, segment)[mode]
+    start_states = tf.constant(bike_core.reset(config, bike_core.batch_size(config), np.random.default_rng(0)))
+    final_artificial_gradient = tf.constant(np.random.default_rng(1).normal(size=start_states.shape) * 1e-3)
+    start = time.perf_counter()
+    tf.nest.map_structure(lambda x: x.numpy(), step(start_states, final_artificial_gradient))
+    trace_seconds = time.perf_counter() - start
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        tf.nest.map_structure(lambda x: x.numpy(), step(start_states, final_artificial_gradient))
+        seconds.append(time.perf_counter() - start)
+    return {"mode": mode, "trace_seconds": trace_seconds, "step_seconds": float(np.median(seconds)),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.}
+
+
+def check(config, segment):
+    # largest differences between the two paths on the same inputs
+    steps = learning_steps(config, segment)
+    start_states = tf.constant(bike_core.reset(config, bike_core.batch_size(config), np.random.default_rng(0)))
+    final_artificial_gradient = tf.constant(np.random.default_rng(1).normal(size=start_states.shape) * 1e-3)
+    tape_grads, tape_d_reward = steps["tape"](start_states, final_artificial_gradient)
+    forward_grads, forward_d_reward = steps["forward"](start_states, final_artificial_gradient)
+    weight_error = max(float(tf.reduce_max(tf.abs(a - b))) for a, b in zip(tape_grads, forward_grads))
+    state_error = float(tf.reduce_max(tf.abs(tape_d_reward - forward_d_reward)))
+    return {"max_weight_gradient_difference": weight_error, "max_state_gradient_difference": state_error}
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    config = bike_core.default_config()
+    config.update(pseudo_batch_size=args.pseudo_batch_size, trajectory_length=args.trajectory_length,
+                  pseudo_trajectory_length=args.pseudo_trajectory_length)
+    if args.mode in ["tape", "forward"]:
+        print(json.dumps(measure(config, args.mode, args.segment, args.repeats)))
+    elif args.mode == "check":
+        print(json.dumps(check(config, args.segment)))
+    else:
+        print("batch", bike_core.batch_size(config), "trajectory_length", args.trajectory_length)
+        print("%-8s %12s %12s %14s" % ("mode", "trace s", "step s", "peak RSS MB"))
+        for mode in ["tape", "forward"]:
+            result = json.loads(subprocess.run([sys.executable, __file__] + sys.argv[1:] + ["--mode", mode], check=True,
+                                               capture_output=True, text=True).stdout.strip().splitlines()[-1])
+            print("%-8s %12.3f %12.4f %14.1f" % (mode, result["trace_seconds"], result["step_seconds"],
+                                                 result["peak_rss_mb"]))
+        print(subprocess.run([sys.executable, __file__] + sys.argv[1:] + ["--mode", "check"], check=True,
+                             capture_output=True, text=True).stdout.strip().splitlines()[-1])
@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+import warnings
+import tensorflow as tf
+import bike_core
+
+# Compiled learning steps are expensive to trace: the whole trajectory_length unroll of policy + physics is built in
+# Python.  Two things live here:
+#  - trace counting, so an unexpected retrace (a new shape or Python value reaching a tf.function) is reported
+#  - a persistent cache of traced functions exported as SavedModels and keyed by everything that is baked into the
+#    graph (physics constants, horizon, batch layout, network shape and the code itself).  A later run with the same
+#    key loads the graph instead of tracing it.  Cached functions must take every changing tensor (weights, goals,
+#    reward rows) as an input, otherwise the loaded copy would carry stale constants and its own variables.
+trace_counts = {}
+graph_keys = ["maximum_dis", "maximum_torque", "action_is_theta", "num_hidden_units", "trajectory_length",
+              "pseudo_trajectory_length", "pseudo_batch_size", "early_termination", "reward_spec", "steering_table"]
+physics_keys = ["c", "d_cm", "h", "l", "m_c", "m_d", "m_p", "r", "v", "gravity", "delta_time", "crash_angle"]
+# every file whose code is traced into the cached learning step
+code_files = ["bike_core.py", "population_bike.py", "graph_cache.py", "training_metrics.py",
+              "steering_geometry.py"]
+
+
+def count_trace(name, expected_traces=1):
+    # call at the top of a tf.function body: Python only runs it while tracing, so this counts traces
+    trace_counts[name] = trace_counts.get(name, 0) + 1
+    if trace_counts[name] > expected_traces:
+        warnings.warn("retracing " + name + " (trace " + str(trace_counts[name]) +
+                      "), check for changing shapes or Python arguments")
+
+
+def code_version():
+    digest = hashlib.sha1()
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for filename in code_files:
+        with open(os.path.join(folder, filename), "rb") as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def config_key(config, **extra):
+    description = {key: config.get(key) for key in graph_keys}
+    description["physics"] = {key: getattr(bike_core, key) for key in physics_keys}
+    description["tensorflow"] = tf.__version__
+    description["code"] = code_version()
+    description.update(extra)
+    return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class graph_cache:
+    def __init__(self, directory="graph_cache"):
+        self.directory = directory
+        self.loaded = []  # keep loaded modules alive, their functions reference them
+
+    def path(self, name, key):
+        return os.path.join(self.directory, name + "_" + key)
+
+    def load(self, name, key):
+        path = self.path(name, key)
+        if not os.path.isdir(path):
+            return None
+        module = tf.saved_model.load(path)
+        self.loaded.append(module)
+        print("graph cache: loaded " + path)
+        return getattr(module, name)
+
+    def save(self, name, key, function):
+        # function must be a tf.function with an input_signature
+        module = tf.Module()
+        setattr(module, name, function)
+        tf.saved_model.save(module, self.path(name, key))
+
+    def get(self, name, key, build):
+        # build() returns a tf.function with an input_signature, it is only called on a cache miss
+        function = self.load(name, key)
+        if function is None:
+            function = build()
+            self.save(name, key, function)
+        return function
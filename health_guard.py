@@ -0,0 +1,71 @@
+import tensorflow as tf
+from training_metrics import per_policy_all_finite
+
+# Numerical health guard around the stacked population update.  The scripts only printed "Nan Grads" from a host side
+# loop and applied the update anyway.  The guard runs as one compiled function next to the optimizer:
+#  - a policy whose gradients or states are non-finite skips the update, including its Adam moments
+#  - optionally, the remaining gradients are clipped by a clipping.gradient_clipper
+#  - every snapshot_every iterations the weights and optimizer slots of healthy policies are copied to an in-memory
+#    snapshot.  A policy whose weights stop being finite, or that keeps failing for `patience` iterations, is rolled
+#    back to it.
+# Incidents are counted per phase and policy in a device variable, so nothing has to be read back every iteration.
+phases = ["nan_gradients", "nan_states", "nan_weights", "rescaled", "rollbacks"]
+
+
+def policy_mask(ok, x):
+    return tf.reshape(ok, [-1] + [1] * (len(x.shape) - 1))
+
+
+class health_guard:
+    def __init__(self, variables, optimizer, population, clipper=None, patience=3, snapshot_every=10):
+        self.variables = list(variables)
+        self.optimizer = optimizer
+        # stacked_adam keeps one moment pair per variable, stacked by policy like the weights
+        self.tracked = self.variables + list(optimizer.m) + list(optimizer.v)
+        self.snapshot = [tf.Variable(x, trainable=False) for x in self.tracked]
+        self.clipper = clipper
+        self.patience = patience
+        self.snapshot_every = snapshot_every
+        self.incidents = tf.Variable(tf.zeros([len(phases), population], tf.int64), trainable=False)
+        self.bad_streak = tf.Variable(tf.zeros([population], tf.int64), trainable=False)
+        self.updates = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.apply = tf.function(self.apply_gradients)
+
+    def apply_gradients(self, gradients, nan_states):
+        # gradients are stacked (K, ...), nan_states is (K,) bool
+        finite = per_policy_all_finite(gradients)
+        ok = tf.logical_and(finite, tf.logical_not(nan_states))
+        gradients = [tf.where(policy_mask(ok, g), g, tf.zeros_like(g)) for g in gradients]
+        rescaled = tf.zeros_like(ok)
+        telemetry = {}
+        if self.clipper is not None:
+            gradients, rescaled, telemetry = self.clipper.clip(gradients, ok)
+            rescaled = tf.logical_and(rescaled, ok)
+        before = [tf.identity(x) for x in self.tracked]
+        self.optimizer.apply_gradients(zip(gradients, self.variables))
+        # skipped policies keep their weights and moments exactly as they were
+        for x, old in zip(self.tracked, before):
+            x.assign(tf.where(policy_mask(ok, x), x, old))
+        weights_finite = per_policy_all_finite(self.variables)
+        streak = tf.where(ok, tf.zeros_like(self.bad_streak), self.bad_streak + 1)
+        rollback = tf.logical_or(tf.logical_not(weights_finite), streak >= self.patience)
+        for x, saved in zip(self.tracked, self.snapshot):
+            x.assign(tf.where(policy_mask(rollback, x), saved, x))
+        self.bad_streak.assign(tf.where(rollback, tf.zeros_like(streak), streak))
+        self.incidents.assign_add(tf.cast(tf.stack([tf.logical_not(finite), nan_states, tf.logical_not(weights_finite),
+                                                    rescaled, rollback]), tf.int64))
+        self.updates.assign_add(1)
+        if self.updates % self.snapshot_every == 0:
+            healthy = tf.logical_and(ok, tf.logical_not(rollback))
+            for x, saved in zip(self.tracked, self.snapshot):
+                saved.assign(tf.where(policy_mask(healthy, x), x, saved))
+        return ok, telemetry
+
+    def take_snapshot(self):
+        # the current state of every policy becomes the rollback point, e.g. after weights were loaded
+        for x, saved in zip(self.tracked, self.snapshot):
+            saved.assign(x)
+
+    def report(self):
+        incidents = self.incidents.numpy()
+        return {phase: incidents[i].tolist() for i, phase in enumerate(phases)}
@@ -0,0 +1,162 @@
+import os
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+import bike_core
+from state_bank import write_bank, open_bank
+
+# Analytic baseline controller.  step() is linearised with batched Jacobians (one tape.batch_jacobian call over all
+# operating points) around steady turns at a grid of handle bar angles theta.  For every operating point a discrete
+# LQR gain is computed for the balance states omega, omega_dot, theta, theta_dot, all gains at once with a batched
+# doubling iteration for the Riccati equation.  Heading is an outer loop: the heading error asks for a handle bar
+# angle, and the gain of the nearest operating point balances the bike around it.  The controller is a plain tensor
+# function, so it runs in bike_core.rollout on the same start state banks as the trained policies.
+parser = argparse.ArgumentParser(description='Gain scheduled LQR baseline for the bike')
+parser.add_argument('--operating_points', type=int, default=41)
+parser.add_argument('--theta_limit', type=float, default=0.3)
+parser.add_argument('--heading_gain', type=float, default=0.5)
+parser.add_argument('--goal', type=int, default=0)
+parser.add_argument('--bank', type=str, default="banks/evaluation_states.npy")
+parser.add_argument('--states', type=int, default=4096)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--steps', type=int, default=1000)
+parser.add_argument('--output', type=str, default="lqr_gains.npz")
+balance_columns = [0, 1, 3, 4]  # omega, omega_dot, theta, theta_dot, a closed subsystem of step()
+state_weights = [100., 1., 1., 0.1]
+action_weights = [1., 1.]
+
+
+def steady_turn_lean(theta):
+    # roll angle omega at which omega_ddot is zero for a fixed handle bar angle and no rider displacement
+    b = bike_core
+    sin_theta, tan_theta = np.abs(np.sin(theta)), np.abs(np.tan(theta))
+    # m_d r (1 / r_f + 1 / r_b) + m h / r_cm of step()
+    curvature = b.m_d * b.r * (sin_theta + tan_theta) / b.l + b.m * b.h / np.sqrt(
+        (b.l - b.c) ** 2 + b.l ** 2 / np.maximum(tan_theta, 1e-300) ** 2)
+    return np.arctan(np.sign(theta) * b.v ** 2 * curvature / (b.m * b.h * b.gravity))
+
+
+def operating_points(config, theta_limit, n):
+    # (n, 12) steady turn states.  step() replaces the r_f, r_b, r_cm terms by a constant exactly at theta == 0, which
+    # hides the steering coupling from the Jacobian, so the centre point sits a hair off zero.
+    thetas = np.linspace(-theta_limit, theta_limit, n)
+    thetas = np.where(thetas == 0., 1e-6, thetas)
+    zeros = np.zeros((n, 1))
+    states = bike_core.initial_states(config, zeros, zeros, zeros, zeros)
+    states[:, 0] = steady_turn_lean(thetas)
+    states[:, 3] = thetas
+    return states
+
+
+def linearise(config, states):
+    # batched Jacobians of the next state with respect to state and (normalised) action, (n, 12, 12) and (n, 12, 2)
+    n = states.shape[0]
+    weights = tf.constant(bike_core.reward_weights(config))
+    goal_position = tf.constant(bike_core.goal_positions(config, n))
+
+    @tf.function
+    def jacobians(states, actions):
+        with tf.GradientTape(persistent=True) as tape:
+            tape.watch([states, actions])
+            next_state = bike_core.step(states, actions, n, config, goal_position, weights)[1]
+        return tape.batch_jacobian(next_state, states), tape.batch_jacobian(next_state, actions)
+    actions = tf.zeros([n, bike_core.action_space(config)], tf.float64)
+    A, B = jacobians(tf.constant(states), actions)
+    return A.numpy(), B.numpy()
+
+
+def discrete_lqr(A, B, Q, R, iterations=100, tolerance=1e-12):
+    # batched structure preserving doubling for the discrete algebraic Riccati equation, quadratic convergence
+    eye = np.eye(A.shape[-1])
+    G = B @ np.linalg.solve(R, np.swapaxes(B, -1, -2))
+    H = np.broadcast_to(Q, A.shape).copy()
+    A_k = A.copy()
+    for _ in range(iterations):
+        W = eye + G @ H
+        W_A = np.linalg.solve(W, A_k)
+        H_next = H + np.swapaxes(A_k, -1, -2) @ H @ W_A
+        G = G + A_k @ np.linalg.solve(W, G @ np.swapaxes(A_k, -1, -2))
+        A_k = A_k @ W_A
+        converged = np.max(np.abs(H_next - H)) <= tolerance * np.max(np.abs(H_next))
+        H = H_next
+        if converged:
+            break
+    BT = np.swapaxes(B, -1, -2)
+    return np.linalg.solve(R + BT @ H @ B, BT @ H @ A)
+
+
+def synthesise(config, theta_limit=0.3, n=41):
+    states = operating_points(config, theta_limit, n)
+    A, B = linearise(config, states)
+    A = A[:, balance_columns][:, :, balance_columns]
+    B = B[:, balance_columns]
+    gains = discrete_lqr(A, B, np.diag(state_weights), np.diag(action_weights[:B.shape[-1]]))
+    return states[:, 3], states[:, balance_columns], gains
+
+
+class gain_schedule:
+    # u = -K_i (x - x_i) with i the operating point nearest to the handle bar angle the heading loop asks for
+    def __init__(self, thetas, equilibria, gains, heading_column, heading_gain=0.5, theta_limit=0.3):
+        self.thetas = tf.constant(thetas, tf.float64)
+        self.equilibria = tf.constant(equilibria, tf.float64)
+        self.gains = tf.constant(gains, tf.float64)
+        self.heading_column = heading_column
+        self.heading_gain = heading_gain
+        self.theta_limit = theta_limit
+
+    def __call__(self, state):
+        heading = tf.math.floormod(state[:, self.heading_column] + np.pi, 2 * np.pi) - np.pi
+        theta_reference = tf.clip_by_value(-self.heading_gain * heading, -self.theta_limit, self.theta_limit)
+        index = tf.argmin(tf.abs(theta_reference[:, None] - self.thetas[None, :]), axis=1)
+        deviation = tf.gather(state, balance_columns, axis=1) - tf.gather(self.equilibria, index)
+        action = -tf.einsum("bij,bj->bi", tf.gather(self.gains, index), deviation)
+        return tf.clip_by_value(action, -1., 1.)
+
+
+def raw_state(state, p_batch_size, weights):
+    return state
+
+
+def save_gains(path, thetas, equilibria, gains):
+    np.savez(path, thetas=thetas, equilibria=equilibria, gains=gains, balance_columns=balance_columns)
+
+
+def evaluate(controller, config, bank, steps, batch=1024):
+    weights = tf.constant(bike_core.reward_weights(config))
+    goal_position = tf.constant(np.tile([[config["xg"], config["yg"]]], (batch, 1)))
+
+    @tf.function(input_signature=[tf.TensorSpec([batch, bike_core.state_dimension], tf.float64)])
+    def run(start_states):
+        return bike_core.rollout(controller, start_states, tf.constant(steps), config, goal_position, weights,
+                                 observation=raw_state)[:3]
+    results = []
+    for start in range(0, bank.shape[0], batch):
+        states = np.array(bank[start:start + batch])
+        n = states.shape[0]
+        if n < batch:
+            states = np.concatenate([states, np.repeat(states[-1:], batch - n, axis=0)])
+        results.append([x.numpy()[:n] for x in run(tf.constant(states))])
+    balance, crashed, progress = [np.concatenate(x) for x in zip(*results)]
+    return {"mean_balance_steps": float(np.mean(balance)), "median_balance_steps": float(np.median(balance)),
+            "crash_rate": float(np.mean(crashed)), "mean_goal_progress": float(np.mean(progress))}
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    config = bike_core.default_config()
+    config["goal"] = bool(args.goal)
+    start = time.perf_counter()
+    thetas, equilibria, gains = synthesise(config, args.theta_limit, args.operating_points)
+    print("linearised and solved", len(thetas), "operating points in %.2fs" % (time.perf_counter() - start))
+    save_gains(args.output, thetas, equilibria, gains)
+    if not os.path.exists(args.bank):
+        os.makedirs(os.path.dirname(args.bank) or ".", exist_ok=True)
+        write_bank(args.bank, config, args.states, "stratified", args.seed)
+    heading_column = bike_core.state_columns.index("psig" if config["goal"] else "psi")
+    controller = gain_schedule(thetas, equilibria, gains, heading_column, args.heading_gain, args.theta_limit)
+    start = time.perf_counter()
+    result = evaluate(controller, config, open_bank(args.bank), args.steps)
+    print("LQR baseline: balance %.1f steps (median %.1f), crash rate %.3f, goal progress %.2f, %.2fs" % (
+        result["mean_balance_steps"], result["median_balance_steps"], result["crash_rate"],
+        result["mean_goal_progress"], time.perf_counter() - start))
@@ -0,0 +1,483 @@
+import os
+import glob
+import atexit
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+import bike_core
+from graph_cache import graph_cache, count_trace, config_key, code_version
+from state_bank import state_bank, refill, fit as fit_bank_states
+from rng_streams import trial_streams, enable_determinism
+from training_metrics import summary_metrics, metric_index, metric_names
+from health_guard import health_guard
+import reward_spec
+from async_writer import background_writer
+from shared_feed import feed_writer, slot_size
+from trajectory_archive import trajectory_archive
+import experiment_catalog
+from clipping import gradient_clipper, save_telemetry, modes as clipping_modes
+from curriculum import length_curriculum, resize_stitching_buffers
+from throughput_tuner import load_profile, apply_profile, knobs as profile_knobs
+
+# Trains K independent policies in one process and one traced graph.  The weights of all policies are stacked along a
+# leading population axis and the bikes are laid out as (K, batch, features), so every policy layer is a single batched
+# matmul.  Each policy has its own reward settings and its own Adam state and learning rate.
+gpus = tf.config.list_physical_devices('GPU')
+if gpus:
+    print(gpus)
+    for gpu in gpus:
+        tf.config.experimental.set_memory_growth(gpu, True)
+#PARSER
+# every per-policy argument takes a comma separated list with either one entry (shared) or one entry per policy
+parser = argparse.ArgumentParser(description='Population based training of several bike policies')
+parser.add_argument('--trialname', type=str, default="trial_1")
+parser.add_argument('--population', type=int, default=2)
+parser.add_argument('--with_psi_restriction', type=str, default="1")
+parser.add_argument('--use_tanh', type=str, default="0,1")
+parser.add_argument('--goal', type=str, default="0")
+parser.add_argument('--test', type=str, default='psiRemoved')
+parser.add_argument('--learning_rate', type=str, default="0.01")
+parser.add_argument('--randomised_state', type=str, default="1")
+parser.add_argument('--max_iterations', type=int, default=200)
+# continue from the last logged iteration of this trial: checkpoints give the weights, the Adam moments start over
+parser.add_argument('--resume', type=int, default=0)
+parser.add_argument('--early_termination', type=int, default=0)
+parser.add_argument('--curriculum', type=int, default=0)
+parser.add_argument('--target_reward', type=float, default=None)
+parser.add_argument('--graph_cache', type=str, default="")
+parser.add_argument('--state_bank', type=str, default="")
+parser.add_argument('--bank_offset', type=int, default=0)
+parser.add_argument('--seed', type=int, default=None)
+parser.add_argument('--physics_spread', type=float, default=0.)
+# a reward spec JSON (see reward_spec.py) is shared by the whole population and replaces the per policy reward flags,
+# in the result names too
+parser.add_argument('--reward_spec', type=str, default="")
+# read the handle bar geometry from tables with this many grid points (see steering_geometry.py), 0 computes it
+parser.add_argument('--steering_table', type=int, default=0)
+# batch layout and thread pools measured by throughput_tuner.py on this host, used when the file exists; --profile ""
+# turns it off.  A profile that changes the batch layout is recorded in the trial name of the results
+parser.add_argument('--profile', type=str, default="throughput_profile.json")
+# also append the logged trajectories to a compressed trajectory_archive per policy
+parser.add_argument('--archive', type=int, default=0)
+# publish metrics every iteration and the trajectory every --feed_every iterations to a shared memory feed of this name
+parser.add_argument('--feed', type=str, default="")
+parser.add_argument('--feed_every', type=int, default=10)
+# every file written to runs/ is added to this experiment catalog, "" turns it off
+parser.add_argument('--catalog', type=str, default="catalog.sqlite")
+parser.add_argument('--clipping', type=str, default="none", choices=clipping_modes)
+parser.add_argument('--clip_norm', type=float, default=1.)
+parser.add_argument('--clip_percentile', type=float, default=90.)
+parser.add_argument('--clip_window', type=int, default=100)
+parser.add_argument('--rollback_patience', type=int, default=3)
+
+
+def per_policy(value, population, cast):
+    values = [cast(x) for x in str(value).split(",")]
+    if len(values) == 1:
+        values = values * population
+    assert len(values) == population, "expected 1 or " + str(population) + " values, got " + str(value)
+    return values
+
+
+def population_forward(input, kernels, biases):
+    # input is (K, batch, features)
+    x = tf.cast(input, tf.float32)
+    for kernel, bias in zip(kernels, biases):
+        y = tf.tanh(tf.matmul(x, kernel) + bias)
+        x = tf.concat([x, y], axis=2)
+    return y
+
+
+class population_model(keras.Model):
+    # K copies of bike_core.model (same dense concatenation layout and initialisation) with stacked weights
+    def __init__(self, population, num_hidden_units=(24, 24), action_space=2,
+                 input_dimension=bike_core.observation_dimension, seed=None):
+        super(population_model, self).__init__()
+        self.population = population
+        self.kernels = []
+        self.biases = []
+        fan_in = input_dimension
+        for i, units in enumerate(list(num_hidden_units) + [action_space]):
+            initializer = keras.initializers.RandomNormal(stddev=0.001, seed=None if seed is None else seed + i)
+            self.kernels.append(tf.Variable(initializer(shape=(population, fan_in, units)), name="kernel"))
+            self.biases.append(tf.Variable(tf.zeros((population, 1, units)), name="bias"))
+            fan_in += units
+
+    def call(self, input):
+        return population_forward(input, self.kernels, self.biases)
+
+    def policy_weights(self, k):
+        # weights of policy k in the order of bike_core.model.get_weights()
+        weights = []
+        for kernel, bias in zip(self.kernels, self.biases):
+            weights += [kernel[k].numpy(), bias[k, 0].numpy()]
+        return weights
+
+    def set_policy_weights(self, k, weights):
+        for i, (kernel, bias) in enumerate(zip(self.kernels, self.biases)):
+            kernel[k].assign(weights[2 * i])
+            bias[k, 0].assign(weights[2 * i + 1])
+
+
+class stacked_adam:
+    # Adam over stacked population weights.  Adam is elementwise, so the moments of different policies never mix;
+    # only the learning rate needs to be per policy.
+    def __init__(self, variables, learning_rates, beta_1=0.9, beta_2=0.999, epsilon=1e-7):
+        self.learning_rates = tf.constant(learning_rates, tf.float32)
+        self.beta_1 = beta_1
+        self.beta_2 = beta_2
+        self.epsilon = epsilon
+        self.iterations = tf.Variable(0., trainable=False)
+        self.m = [tf.Variable(tf.zeros_like(variable), trainable=False) for variable in variables]
+        self.v = [tf.Variable(tf.zeros_like(variable), trainable=False) for variable in variables]
+
+    def apply_gradients(self, grads_and_vars):
+        self.iterations.assign_add(1.)
+        correction = tf.sqrt(1. - self.beta_2 ** self.iterations) / (1. - self.beta_1 ** self.iterations)
+        for (gradient, variable), m, v in zip(grads_and_vars, self.m, self.v):
+            m.assign(self.beta_1 * m + (1. - self.beta_1) * gradient)
+            v.assign(self.beta_2 * v + (1. - self.beta_2) * tf.square(gradient))
+            learning_rate = tf.reshape(self.learning_rates, [-1] + [1] * (len(variable.shape) - 1))
+            variable.assign_sub(learning_rate * correction * m / (tf.sqrt(v) + self.epsilon))
+
+
+def last_logged_iteration(trial_name, filename):
+    # marker of the newest results file of a policy, -1 when it has none
+    paths = glob.glob("runs/" + trial_name + "_marker_*_results_" + filename + ".npy")
+    return max([experiment_catalog.parse_name(path)["marker"] for path in paths], default=-1)
+
+
+def diff(t_a, t_b):
+    t_diff = relativedelta(t_b, t_a)  # later/end time comes first!
+    return '{h}h {m}m {s}s'.format(h=t_diff.hours, m=t_diff.minutes, s=t_diff.seconds)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    population = int(args.population)
+    trial_name = str(args.trialname)
+    #EXPERIMENT SETTINGS
+    config = bike_core.default_config()
+    config["max_iterations"] = args.max_iterations
+    config["early_termination"] = bool(args.early_termination)
+    profile = load_profile(args.profile)
+    if profile is not None:
+        layout = [config[key] for key in ["pseudo_batch_size", "trajectory_length", "pseudo_trajectory_length"]]
+        apply_profile(profile, config)
+        print("using throughput profile", args.profile, {key: profile[key] for key in profile_knobs})
+        if layout != [config[key] for key in ["pseudo_batch_size", "trajectory_length", "pseudo_trajectory_length"]]:
+            trial_name += "_profile_b%d_t%d_p%d" % (config["pseudo_batch_size"], config["trajectory_length"],
+                                                    config["pseudo_trajectory_length"])
+    pseudo_batch_size = config["pseudo_batch_size"]
+    action_space = bike_core.action_space(config)
+    trajectory_length = config["trajectory_length"]
+    max_chunks = bike_core.chunks(config)
+    curriculum = None
+    if args.reward_spec:
+        config["reward_spec"] = reward_spec.load(args.reward_spec)
+    if args.steering_table:
+        # the tables hold the nominal bike only
+        assert args.physics_spread == 0., "--steering_table needs --physics_spread 0"
+        assert args.steering_table >= 3 and args.steering_table % 2 == 1, "--steering_table needs an odd point count"
+        config["steering_table"] = args.steering_table
+    if args.curriculum:
+        curriculum = length_curriculum(trajectory_length, max_chunks, target_reward=args.target_reward)
+        config["pseudo_trajectory_length"] = curriculum.pseudo_trajectory_length
+    batch_size = bike_core.batch_size(config)
+    policy_configs = []
+    for k in range(population):
+        policy_config = dict(config)
+        policy_config["with_psi_restriction"] = per_policy(args.with_psi_restriction, population, int)[k]
+        policy_config["use_tanh"] = per_policy(args.use_tanh, population, int)[k]
+        policy_config["goal"] = per_policy(args.goal, population, int)[k]
+        policy_config["test"] = per_policy(args.test, population, str)[k]
+        policy_config["randomised_state"] = bool(per_policy(args.randomised_state, population, int)[k])
+        policy_config["learning_rate"] = per_policy(args.learning_rate, population, float)[k]
+        if args.reward_spec:
+            # the spec replaces the reward flags, so it also names the results
+            policy_config.update(reward_spec.name_flags(config["reward_spec"], args.reward_spec))
+        policy_configs.append(policy_config)
+    filenames = [bike_core.run_filename(trial_name + "_policy_" + str(k), policy_configs[k]) for k in range(population)]
+    prinit = True
+    save = True
+    print_time = 1
+    log_time = 10
+    # without --seed everything comes from the global generators as before
+    streams = None
+    state_rng = goal_rng = np.random
+    weight_seed = None
+    if args.seed is not None:
+        enable_determinism()
+        streams = trial_streams(args.seed, trial_name)
+        state_rng = streams.numpy("states")
+        goal_rng = streams.numpy("goals")
+        weight_seed = streams.seed_for("weights")
+    if args.reward_spec:
+        policy_weights = np.tile(reward_spec.weights_row(config["reward_spec"]), (population, 1))
+    else:
+        policy_weights = np.stack([bike_core.reward_weights(pc) for pc in policy_configs])
+    # goals and physics belong to a trajectory, so every chunk of trajectory k gets the values of row k
+    goal_bank = bike_core.goal_positions(config, population * pseudo_batch_size, goal_rng).reshape(
+        (population, pseudo_batch_size, 2))
+    # per bike physics parameters, the nominal bike everywhere unless --physics_spread randomises them
+    physics_bank = bike_core.physics_table(population * pseudo_batch_size, args.physics_spread,
+                                           streams.numpy("physics") if streams is not None else np.random).reshape(
+        (population, pseudo_batch_size, bike_core.physics_dimension))
+    population_network = population_model(population, config["num_hidden_units"], action_space, seed=weight_seed)
+    network_variables = population_network.kernels + population_network.biases
+    n_layers = len(population_network.kernels)
+    opt = stacked_adam(network_variables, [pc["learning_rate"] for pc in policy_configs])
+    # every update goes through the guard, which skips or rolls back policies with non-finite numbers and clips the rest
+    clipper = gradient_clipper(args.clipping, population, n_layers, args.clip_norm, args.clip_percentile,
+                               args.clip_window)
+    guard = health_guard(network_variables, opt, population, clipper, args.rollback_patience, log_time)
+    cache = graph_cache(args.graph_cache) if args.graph_cache else None
+
+    def make_dolearn(config):
+        # one traced learning step per batch layout, the curriculum switches between them.  Everything that changes
+        # between runs with the same graph is an input, so the step can be exported to and loaded from the graph cache.
+        batch_size = bike_core.batch_size(config)
+        rows = population * batch_size
+        input_signature = [tf.TensorSpec([population, batch_size, bike_core.state_dimension], tf.float64),
+                           tf.TensorSpec([population, batch_size, bike_core.state_dimension], tf.float64),
+                           tf.TensorSpec([rows, 2], tf.float64),
+                           tf.TensorSpec([rows, bike_core.reward_dimension], tf.float64),
+                           tf.TensorSpec([rows, bike_core.physics_dimension], tf.float64),
+                           [tf.TensorSpec(variable.shape, variable.dtype) for variable in network_variables]]
+
+        def dolearn(start_states, final_artificial_gradient, goal_position, weights, physics, network_weights):
+            # start_states and final_artificial_gradient are (K, batch, 12), goal_position, weights and physics have
+            # one row per bike
+            count_trace("dolearn_" + str(bike_core.chunks(config)))
+            kernels = network_weights[:n_layers]
+            biases = network_weights[n_layers:]
+
+            def policy(converted_state):
+                x = tf.reshape(converted_state, [population, batch_size, bike_core.observation_dimension])
+                return tf.reshape(population_forward(x, kernels, biases), [rows, action_space])
+
+            with tf.GradientTape() as tape:
+                tape.watch([start_states] + list(network_weights))
+                [total_rewards, trajectory, action_hisotry, trajectories_terminated] = bike_core.expand_trajectories(
+                    policy, tf.reshape(start_states, [rows, bike_core.state_dimension]),
+                    tf.reshape(final_artificial_gradient, [rows, bike_core.state_dimension]),
+                    rows, config, goal_position, weights, None if config.get("steering_table") else physics)
+                total_rewards = tf.reshape(total_rewards, [population, batch_size])
+                # the policies share no weights, so the gradient of the summed cost is each policy's own gradient
+                cost_ = -tf.reduce_sum(tf.reduce_mean(total_rewards, axis=1))
+            grads = tape.gradient(cost_, [start_states] + list(network_weights))
+            dCost_dWeights = grads[1:]
+            # each start state only feeds its own row, undo the batch mean to get d(row reward)/d(row start state)
+            dReward_dInputState = -grads[0] * batch_size
+            metrics = summary_metrics(trajectory, total_rewards, dCost_dWeights, trajectories_terminated, population)
+            final_state = tf.reshape(trajectory[-1], [population, batch_size, bike_core.state_dimension])
+            trajectories_terminated = tf.reshape(trajectories_terminated, [population, batch_size])
+            return dCost_dWeights, dReward_dInputState, final_state, trajectories_terminated, metrics, trajectory, \
+                action_hisotry
+
+        def build():
+            return tf.function(dolearn, input_signature=input_signature)
+        if cache is None:
+            learn_function = build()
+        else:
+            learn_function = cache.get("dolearn", config_key(config, population=population), build)
+        # goals and reward rows for this layout, (K * batch, 2) and (K * batch, reward_dimension)
+        chunks = bike_core.chunks(config)
+        goal_position = tf.constant(np.tile(goal_bank, (1, chunks, 1)).reshape((rows, 2)))
+        weights = tf.constant(np.repeat(policy_weights, batch_size, axis=0))
+        physics = tf.constant(np.tile(physics_bank, (1, chunks, 1)).reshape((rows, bike_core.physics_dimension)))
+        return lambda start_states, final_artificial_gradient: learn_function(
+            start_states, final_artificial_gradient, goal_position, weights, physics, network_variables)
+
+    learn_functions = {}
+    #TRAINING
+    if save:
+        os.makedirs("runs", exist_ok=True)
+        os.makedirs("checkpoints", exist_ok=True)
+    bank = state_bank(args.state_bank, args.bank_offset) if args.state_bank else None
+
+    def row_physics(k, batch_size, copies=1):
+        # row j of policy k is a chunk of trajectory j % pseudo_batch_size and belongs to that bike
+        return np.tile(physics_bank[k], (copies * batch_size // pseudo_batch_size, 1))
+
+    def bank_states(copies, batch_size):
+        # (copies, K, batch, 12) bank states, fitted to each policy's state mode and each row's wheelbase
+        states = bank.take((population, copies * batch_size, bike_core.state_dimension))
+        return np.stack([fit_bank_states(pc, states[k], row_physics(k, batch_size, copies)).reshape(
+            (copies, batch_size, bike_core.state_dimension)) for k, pc in enumerate(policy_configs)], axis=1)
+
+    def fresh_states(batch_size):
+        if bank is not None:
+            return bank_states(1, batch_size)[0]
+        return np.stack([bike_core.reset(pc, batch_size, state_rng, row_physics(k, batch_size))
+                         for k, pc in enumerate(policy_configs)])
+
+    def make_device_bank(batch_size):
+        # bank states kept on the device in slots of one state per row, so refill() with a cursor that advances by
+        # the row count gives every crashed row a state fitted to its own bike
+        copies = max(1, (1 << 16) // (population * batch_size))
+        return tf.constant(bank_states(copies, batch_size).reshape((-1, bike_core.state_dimension)))
+    if bank is not None:
+        device_bank = make_device_bank(batch_size)
+        bank_cursor = tf.Variable(0, trainable=False)
+
+    @tf.function
+    def stitch(initial_state, initial_state_backup, final_state, trajectories_terminated, d_reward,
+               final_artificial_gradient, device_bank):
+        # the wrap-around on the device; with a bank, crashed rows restart from new bank states instead of the backup
+        initial_state, final_artificial_gradient, restart = bike_core.device_wrap_around(
+            initial_state, initial_state_backup, final_state, trajectories_terminated, d_reward,
+            final_artificial_gradient, pseudo_batch_size, config["try_to_wrap_around_gradients"])
+        if device_bank is not None:
+            initial_state = tf.reshape(refill(tf.reshape(initial_state, [-1, bike_core.state_dimension]),
+                                              tf.reshape(restart, [-1]), device_bank, bank_cursor),
+                                       tf.shape(initial_state))
+            bank_cursor.assign(tf.math.floormod(bank_cursor + tf.size(restart), tf.shape(device_bank)[0]))
+        return initial_state, final_artificial_gradient
+    # the stitching buffers stay on the device between iterations
+    initial_state = tf.constant(fresh_states(batch_size))
+    initial_state_backup = initial_state
+    final_artificial_gradient = tf.zeros_like(initial_state)
+    reward_history = [[] for _ in range(population)]
+    timestep_history = [[] for _ in range(population)]
+    # per iteration clipping telemetry, kept as device tensors until the next logging iteration
+    gradient_telemetry = []
+    keras_action_network = bike_core.build_network(config)
+    start_iteration = 0
+    if args.resume:
+        for k in range(population):
+            checkpoint = "./checkpoints/my_checkpoint_" + trial_name + "_policy_" + str(k)
+            if os.path.exists(checkpoint + ".index"):
+                keras_action_network.load_weights(checkpoint).expect_partial()
+                population_network.set_policy_weights(k, keras_action_network.get_weights())
+        guard.take_snapshot()
+        start_iteration = min(last_logged_iteration(trial_name, filename) for filename in filenames) + 1
+        print("resuming ", trial_name, " at iteration ", start_iteration)
+    # saves run on a background thread, keras_action_network is only touched by that thread from here on
+    writer = background_writer()
+
+    archives = [trajectory_archive("runs/" + trial_name + "_trajectories_" + filenames[k] + ".zip", "a")
+                for k in range(population)] if args.archive else None
+
+    catalog = experiment_catalog.connect(args.catalog) if args.catalog else None
+    version = code_version()
+
+    def catalogue(path):
+        # runs on the writer thread after the write it describes
+        if catalog is not None:
+            experiment_catalog.add(catalog, path, seed=args.seed, code_version=version)
+
+    def save_last_states(iteration, trajectory, shape):
+        trajectory = trajectory.numpy().reshape((-1,) + shape)
+        for k in range(population):
+            np.save("runs/last_state_" + filenames[k] + ".npy", trajectory[:, k])
+            catalogue("runs/last_state_" + filenames[k] + ".npy")
+            if archives:
+                # with randomised physics the bikes are not all bike_core.l long, so the back wheel is kept
+                archives[k].append(iteration, trajectory[:, k], None if args.physics_spread else bike_core.l)
+
+    def close_archives():
+        # after the pending appends, a zip is only readable once close() wrote its central directory.  Registered
+        # with atexit, so it also runs when training raises or the writer's SIGTERM / SIGINT handler exits.
+        try:
+            writer.close()
+        finally:
+            while archives:
+                archive = archives.pop(0)
+                archive.close()
+                catalogue(archive.path)
+    if archives is not None:
+        atexit.register(close_archives)
+
+    def write_checkpoint(path, weights):
+        # per policy checkpoints are plain bike_core.model checkpoints
+        keras_action_network.set_weights(weights)
+        keras_action_network.save_weights(path)
+    feed = None
+    if args.feed:
+        # slots are sized for the largest batch layout the curriculum can reach
+        feed_rows = population * pseudo_batch_size * max_chunks
+        feed = feed_writer(args.feed, slot_size([
+            ((trajectory_length + 1, feed_rows, bike_core.state_dimension), np.float64),
+            ((trajectory_length, feed_rows, action_space), np.float32),
+            ((population, len(metric_names)), np.float64), ((1,), np.int64)]))
+
+    t_a = datetime.now()
+    for iteration in range(start_iteration, config["max_iterations"]):
+        iteration_start = time.perf_counter()
+        chunks = bike_core.chunks(config)
+        if chunks not in learn_functions:
+            learn_functions[chunks] = make_dolearn(dict(config))
+        dCost_dWeights, dReward_dInputState, final_state, trajectories_terminated, metrics, trajectory, actions = \
+            learn_functions[chunks](initial_state, final_artificial_gradient)
+        _, telemetry = guard.apply(dCost_dWeights, metrics[:, metric_index["nan_states"]] > 0)
+        gradient_telemetry.append(telemetry)
+        # only the small per policy metrics come to the host every iteration
+        metrics = metrics.numpy()
+        initial_state, final_artificial_gradient = stitch(
+            initial_state, initial_state_backup, final_state, trajectories_terminated, dReward_dInputState,
+            final_artificial_gradient, device_bank if bank is not None else None)
+        if feed is not None:
+            message = {"iteration": np.array([iteration]), "metrics": metrics}
+            if iteration % args.feed_every == 0:
+                message.update(trajectory=trajectory.numpy(), actions=actions.numpy())
+            # straight into the ring, not through the writer queue: a memcpy that never waits on readers or on a
+            # backed up queue
+            feed.publish(message)
+        for k in range(population):
+            reward_history[k].append(metrics[k, metric_index["max_reward"]])
+            timestep_history[k].append(metrics[k, metric_index["max_balance_steps"]])
+        if np.any(metrics[:, metric_index["nan_gradients"]]):
+            print("Nan Grads, update skipped for policies ", np.flatnonzero(metrics[:, metric_index["nan_gradients"]]))
+        if curriculum is not None:
+            new_chunks = curriculum.update(iteration, np.max(metrics[:, metric_index["max_balance_steps"]]),
+                                           np.max(metrics[:, metric_index["max_reward"]]),
+                                           time.perf_counter() - iteration_start)
+            if new_chunks != chunks:
+                config["pseudo_trajectory_length"] = curriculum.pseudo_trajectory_length
+                batch_size = bike_core.batch_size(config)
+                # a rare layout change, so the buffers take one trip through the host
+                buffers = resize_stitching_buffers(
+                    initial_state.numpy(), initial_state_backup.numpy(), final_artificial_gradient.numpy(),
+                    pseudo_batch_size, new_chunks, fresh_states(batch_size)[:, chunks * pseudo_batch_size:])
+                initial_state, initial_state_backup, final_artificial_gradient = [tf.constant(x) for x in buffers]
+                if bank is not None:
+                    device_bank = make_device_bank(batch_size)
+                    bank_cursor.assign(0)
+                print("curriculum: pseudo_trajectory_length ", config["pseudo_trajectory_length"])
+        if prinit and iteration % print_time == 0:
+            t_b = datetime.now()
+            print("iteration: ", iteration, "// max reward per policy: ", metrics[:, metric_index["max_reward"]],
+                  "max steps per policy: ", metrics[:, metric_index["max_balance_steps"]],
+                  "time taken from last iter: ", diff(t_a, t_b))
+            t_a = t_b
+        if save and (iteration % log_time == 0 or iteration == config["max_iterations"] - 1):
+            # logging iteration, the only time the full trajectory leaves the device, on the writer thread
+            print("health incidents per policy: ", guard.report())
+            telemetry_path = "runs/" + trial_name + "_marker_" + str(iteration) + "_gradient_norms_" + trial_name + \
+                "_clipping_" + args.clipping + ".npz"
+            writer.submit(save_telemetry, telemetry_path, gradient_telemetry)
+            writer.submit(catalogue, telemetry_path)
+            gradient_telemetry = []
+            writer.submit(save_last_states, iteration, trajectory, tuple(final_state.shape))
+            for k in range(population):
+                save_mat = np.concatenate([[reward_history[k]], [timestep_history[k]]], axis=0)
+                results_path = "runs/" + trial_name + "_marker_" + str(iteration) + "_results_" + filenames[k] + ".npy"
+                writer.save(results_path, save_mat)
+                writer.submit(catalogue, results_path)
+                writer.submit(write_checkpoint, "./checkpoints/my_checkpoint_" + trial_name + "_policy_" + str(k),
+                              population_network.policy_weights(k))
+                reward_history[k] = []
+                timestep_history[k] = []
+    writer.close()
+    close_archives()
+    if feed is not None:
+        feed.close()
+    print("background writer: ", writer.written, "writes, ", writer.stalled_seconds, "seconds waiting for the disk")
+    if curriculum is not None:
+        print("curriculum time to target reward (fixed length figures are estimates): ", curriculum.summary())
+    print("health incidents per policy: ", guard.report())
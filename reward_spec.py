@@ -0,0 +1,90 @@
+import os
+import json
+import math
+import hashlib
+import argparse
+import bike_core
+
+# Declarative reward specs.  A spec lists the barrier penalty terms (the state column they read, weight, width and power)
+# together with the tanh wrapper and whether progress is measured toward the goal or along y.  Put a spec in
+# config["reward_spec"] and bike_core.step compiles it with bike_core.compile_reward, so only the enabled terms end up in
+# the graph.  A new ablation is a JSON file instead of another branch of the "test" if-chain:
+#   {"terms": [{"name": "angle", "column": "omega", "weight": 1.0, "width": 0.2094, "power": 8}],
+#    "tanh": true, "goal": false, "progress_weight": 1.0}
+# The three penalties of the training scripts, in the order step() always summed them
+standard_terms = [
+    {"name": "psi", "column": "psig", "width": math.pi / 2, "power": 8},
+    {"name": "angle", "column": "omega", "width": math.pi / 15, "power": 8},
+    {"name": "handle", "column": "theta", "width": 1.3963 * 0.9, "power": 8},
+]
+
+
+def from_config(config):
+    # the spec equivalent to the test / with_psi_restriction / use_tanh / goal flags, see bike_core.reward_weights
+    weights = bike_core.reward_weights(config)
+    terms = [dict(term, weight=float(weight)) for term, weight in zip(standard_terms, weights[:3]) if weight != 0.]
+    return {"terms": terms, "tanh": bool(weights[3]), "goal": bool(weights[4]), "progress_weight": 1.}
+
+
+def validate(spec):
+    spec = dict(spec)
+    spec.setdefault("tanh", False)
+    spec.setdefault("goal", False)
+    spec.setdefault("progress_weight", 1.)
+    terms = []
+    for term in spec.get("terms", []):
+        assert term["column"] in bike_core.state_columns, "unknown state column " + str(term["column"])
+        term = dict(term)
+        term.setdefault("name", term["column"])
+        term.setdefault("weight", 1.)
+        term.setdefault("power", 8)
+        assert "width" in term, "reward term " + term["name"] + " needs a width"
+        terms.append(term)
+    spec["terms"] = terms
+    return spec
+
+
+def load(path):
+    with open(path) as source:
+        return validate(json.load(source))
+
+
+def save(path, spec):
+    with open(path, "w") as output:
+        json.dump(validate(spec), output, indent=2)
+
+
+def name_flags(spec, path):
+    # run_filename flags for policies trained on spec: tanh, goal and psi follow the spec, test names the file and a
+    # hash of its contents, so runs of the same spec share a label and edited specs do not
+    digest = hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:8]
+    return {"use_tanh": int(spec["tanh"]), "goal": int(spec["goal"]),
+            "with_psi_restriction": int(any(term["name"] == "psi" and term["weight"] for term in spec["terms"])),
+            "test": "spec-" + os.path.splitext(os.path.basename(path))[0].replace("_", "-") + "-" + digest}
+
+
+def weights_row(spec):
+    # reward_weights style row for code that still reads the weight columns, e.g. converter() takes its heading from
+    # the goal column.  Terms outside the three standard ones have no column and are left out.
+    weights = [0.] * bike_core.reward_dimension
+    for i, standard in enumerate(standard_terms):
+        weights[i] = sum(term["weight"] for term in spec["terms"] if term["name"] == standard["name"])
+    weights[3] = float(spec["tanh"])
+    weights[4] = float(spec["goal"])
+    return weights
+
+
+if __name__ == "__main__":
+    # write the spec of a flag combination, as a starting point for a new ablation
+    parser = argparse.ArgumentParser(description='Write the reward spec equivalent to the training script flags')
+    parser.add_argument('--output', type=str, default="reward_spec.json")
+    parser.add_argument('--with_psi_restriction', type=int, default=1)
+    parser.add_argument('--use_tanh', type=int, default=0)
+    parser.add_argument('--goal', type=int, default=0)
+    parser.add_argument('--test', type=str, default='psiRemoved')
+    args = parser.parse_args()
+    config = bike_core.default_config()
+    config.update(with_psi_restriction=args.with_psi_restriction, use_tanh=args.use_tanh, goal=args.goal,
+                  test=args.test)
+    save(args.output, from_config(config))
+    print("wrote", args.output)
@@ -0,0 +1,81 @@
+import zlib
+import argparse
+import numpy as np
+import tensorflow as tf
+import bike_core
+
+# Seeded random streams.  reset(), the goal positions and the RandomNormal initialisers all used the global unseeded
+# NumPy / TF generators, so no trial could be reproduced.  A trial_streams object hands out one generator per named
+# purpose ("states", "goals", "weights", ...).  The generators are counter based (Philox): the key comes from the seed,
+# the trial, the worker and the stream name, so different purposes never draw overlapping numbers and adding a new
+# stream does not shift the numbers of the existing ones.  worker_streams() gives every replica of distributed_bike.py
+# its own streams.  All random draws are NumPy ones, TF itself draws nothing.
+
+
+def stable_id(value):
+    # Python's hash() is salted per process, crc32 is not
+    return zlib.crc32(str(value).encode()) if not isinstance(value, int) else value
+
+
+def enable_determinism():
+    # bit identical reruns on CPU also need deterministic kernels and a single inter-op schedule
+    if hasattr(tf.config.experimental, "enable_op_determinism"):
+        tf.config.experimental.enable_op_determinism()
+
+
+class trial_streams:
+    def __init__(self, seed, trial=0, worker=0):
+        self.seed = int(seed)
+        self.trial = stable_id(trial)
+        self.worker = int(worker)
+
+    def key(self, name):
+        sequence = np.random.SeedSequence(self.seed, spawn_key=(self.trial, self.worker, stable_id(name)))
+        return sequence.generate_state(2, np.uint64)
+
+    def numpy(self, name):
+        return np.random.Generator(np.random.Philox(key=self.key(name)))
+
+    def seed_for(self, name):
+        # plain int seeds for APIs that only take one, such as keras initializers
+        return int(self.key(name)[0] % np.uint64(2 ** 31 - 1))
+
+    def worker_streams(self, worker):
+        return trial_streams(self.seed, self.trial, worker)
+
+
+def check_reproducible(seed=0, iterations=3):
+    # runs the same short training twice from the same seed and compares the trajectories byte for byte
+    enable_determinism()
+    config = bike_core.default_config()
+    runs = []
+    for _ in range(2):
+        streams = trial_streams(seed, "reproducibility_check")
+        batch_size = bike_core.batch_size(config)
+        state = bike_core.reset(config, batch_size, streams.numpy("states"))
+        goal_position = tf.constant(bike_core.goal_positions(config, batch_size, streams.numpy("goals")))
+        weights = tf.constant(bike_core.reward_weights(config))
+        network = bike_core.build_network(config, streams.seed_for("weights"))
+        opt = tf.keras.optimizers.Adam(config["learning_rate"])
+        final_artificial_gradient = tf.zeros_like(state)
+        trajectories = []
+        for iteration in range(iterations):
+            with tf.GradientTape() as tape:
+                [total_rewards, trajectory, actions, terminated] = bike_core.expand_trajectories(
+                    network, tf.constant(state), final_artificial_gradient, batch_size, config, goal_position, weights)
+                cost_ = -tf.reduce_mean(total_rewards)
+            opt.apply_gradients(zip(tape.gradient(cost_, network.trainable_weights), network.trainable_weights))
+            trajectories.append(trajectory.numpy())
+            state = trajectory.numpy()[-1]
+        runs.append(np.stack(trajectories))
+    identical = runs[0].tobytes() == runs[1].tobytes()
+    print("seed", seed, "bit identical trajectories:", identical)
+    return identical
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check that a seed reproduces bit identical trajectories')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    tf.config.set_visible_devices([], 'GPU')
+    assert check_reproducible(args.seed)
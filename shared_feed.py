@@ -0,0 +1,164 @@
+import time
+import argparse
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+# Live feed of the latest training data through a multiprocessing.shared_memory ring buffer.  The trainer publishes a
+# dict of NumPy arrays (trajectory, actions, metrics, ...) into the next slot of the ring, and any number of local
+# readers attach by name and read the arrays straight out of shared memory, without pickling or a connection to the
+# trainer.  The readers never slow the trainer down: it does not wait for them, and a reader that falls behind just
+# sees newer sequence numbers.
+#
+# Layout: a global header of int64 [magic, version, slots, slot_bytes, latest sequence number], then `slots` slots,
+# each a slot header followed by the payload.  The slot header carries the slot's sequence number and one entry
+# (name, dtype, shape, offset, size) per array.  A slot's sequence number is odd while it is written and even once
+# complete (a seqlock), so a reader that sees the same even number before and after copying has a consistent slot.
+magic = 0x42494b45  # "BIKE"
+version = 1
+max_arrays = 8
+max_dimensions = 6
+global_header = np.dtype([("magic", "<i8"), ("version", "<i8"), ("slots", "<i8"), ("slot_bytes", "<i8"),
+                          ("latest", "<i8")])
+entry_dtype = np.dtype([("name", "S24"), ("dtype", "S8"), ("ndim", "<i8"), ("shape", "<i8", (max_dimensions,)),
+                        ("offset", "<i8"), ("nbytes", "<i8")])
+slot_header = np.dtype([("seq", "<i8"), ("count", "<i8"), ("entries", entry_dtype, (max_arrays,))])
+
+
+def header_bytes(dtype):
+    # headers are padded to 64 bytes so payloads stay aligned
+    return -(-dtype.itemsize // 64) * 64
+
+
+def slot_size(shapes_and_dtypes):
+    # payload bytes for a list of (shape, dtype), each array aligned to 64 bytes
+    return sum(-(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 64) * 64 for shape, dtype in shapes_and_dtypes)
+
+
+class feed_layout:
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.header = np.ndarray((), global_header, buffer, 0)
+
+    def slot_offset(self, slot):
+        return header_bytes(global_header) + slot * (header_bytes(slot_header) + int(self.header["slot_bytes"]))
+
+    def slot(self, slot):
+        offset = self.slot_offset(slot)
+        return np.ndarray((), slot_header, self.buffer, offset), offset + header_bytes(slot_header)
+
+
+class feed_writer:
+    def __init__(self, name, slot_bytes, slots=4):
+        size = header_bytes(global_header) + slots * (header_bytes(slot_header) + slot_bytes)
+        self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.layout = feed_layout(self.memory.buf)
+        self.layout.header[()] = (magic, version, slots, slot_bytes, -1)
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.seq = 0
+        for slot in range(slots):
+            self.layout.slot(slot)[0]["seq"] = -2
+
+    def publish(self, arrays):
+        # arrays is a dict of name -> NumPy array, copied into the next slot
+        assert len(arrays) <= max_arrays, "at most " + str(max_arrays) + " arrays per message"
+        header, payload = self.layout.slot(self.seq % self.slots)
+        header["seq"] = 2 * self.seq + 1
+        entries = header["entries"]
+        offset = 0
+        for i, (name, array) in enumerate(arrays.items()):
+            array = np.ascontiguousarray(array)
+            assert array.ndim <= max_dimensions and offset + array.nbytes <= self.slot_bytes, \
+                "array " + name + " does not fit the feed slot"
+            shape = tuple(array.shape) + (0,) * (max_dimensions - array.ndim)
+            entries[i] = (name.encode(), array.dtype.str.encode(), array.ndim, shape, offset, array.nbytes)
+            np.ndarray(array.shape, array.dtype, self.memory.buf, payload + offset)[...] = array
+            offset += -(-array.nbytes // 64) * 64
+        header["count"] = len(arrays)
+        header["seq"] = 2 * self.seq + 2
+        self.layout.header["latest"] = self.seq
+        self.seq += 1
+        return self.seq - 1
+
+    def close(self):
+        del self.layout
+        self.memory.close()
+        self.memory.unlink()
+
+
+class feed_reader:
+    def __init__(self, name):
+        self.memory = shared_memory.SharedMemory(name=name)
+        # the resource tracker would unlink the trainer's segment when this reader exits (bpo-39959)
+        resource_tracker.unregister(self.memory._name, "shared_memory")
+        self.layout = feed_layout(self.memory.buf)
+        assert int(self.layout.header["magic"]) == magic and int(self.layout.header["version"]) == version, \
+            "not a bike feed"
+        self.slots = int(self.layout.header["slots"])
+
+    def latest_seq(self):
+        return int(self.layout.header["latest"])
+
+    def read(self, seq=None, copy=True, retries=3):
+        # (seq, arrays) of message seq (default the latest), or None if it was never written or already overwritten.
+        # With copy=False the arrays are views into shared memory, only valid while valid(seq) holds.  A read of the
+        # latest message that the writer tears retries on the new latest, a read of a given seq does not.
+        for attempt in range(retries + 1 if seq is None else 1):
+            message = self.read_slot(self.latest_seq() if seq is None else seq, copy)
+            if message is not None:
+                return message
+        return None
+
+    def read_slot(self, seq, copy):
+        if seq < 0:
+            return None
+        header, payload = self.layout.slot(seq % self.slots)
+        if int(header["seq"]) != 2 * seq + 2:
+            return None
+        arrays = {}
+        try:
+            for entry in header["entries"][:int(header["count"])]:
+                shape = tuple(int(x) for x in entry["shape"][:int(entry["ndim"])])
+                view = np.ndarray(shape, np.dtype(entry["dtype"].decode()), self.memory.buf,
+                                  payload + int(entry["offset"]))
+                arrays[entry["name"].decode()] = view.copy() if copy else view
+        except (TypeError, ValueError, UnicodeDecodeError):
+            # an entry half rewritten by the writer can describe any dtype, shape or offset
+            if self.valid(seq):
+                raise
+            return None
+        if not self.valid(seq):
+            return None  # overwritten while copying
+        return seq, arrays
+
+    def valid(self, seq):
+        return int(self.layout.slot(seq % self.slots)[0]["seq"]) == 2 * seq + 2
+
+    def wait(self, after=-1, timeout=None, poll=0.01):
+        # blocks until a message newer than `after` is complete
+        start = time.perf_counter()
+        while timeout is None or time.perf_counter() - start < timeout:
+            message = self.read()
+            if message is not None and message[0] > after:
+                return message
+            time.sleep(poll)
+        return None
+
+    def close(self):
+        del self.layout
+        self.memory.close()
+
+
+if __name__ == "__main__":
+    # minimal live monitor: prints the metrics of every message it sees
+    parser = argparse.ArgumentParser(description='Follow the live training feed')
+    parser.add_argument('--name', type=str, default="bike_feed")
+    args = parser.parse_args()
+    reader = feed_reader(args.name)
+    seq = -1
+    while True:
+        message = reader.wait(seq)
+        seq, arrays = message
+        print("message", seq, {name: array.shape for name, array in arrays.items()})
+        if "metrics" in arrays:
+            print(arrays["metrics"])
@@ -0,0 +1,111 @@
+import os
+import argparse
+from statistics import NormalDist
+import numpy as np
+import tensorflow as tf
+import bike_core
+
+# Banks of pre-generated initial states.  reset() draws a fresh batch with several NumPy calls every time and the stitched
+# layout keeps initial_state_backup around to restart crashed rows.  A bank is a large (n, 12) pool written once to a
+# .npy file and opened memory mapped, so trials can share the exact same start sets and crashed rows can be refilled by
+# an index instead of a new sample.
+#
+# Sampling methods, all drawn from the same distribution as bike_core.reset:
+#   random      independent draws, like reset()
+#   stratified  latin hypercube over (omega, theta, xb, xf offset), every marginal is evenly covered
+#   sobol       scrambled Sobol sequence (needs scipy), low discrepancy over the joint space
+methods = ["random", "stratified", "sobol"]
+
+
+def unit_samples(n, method, seed):
+    # (n, 4) samples in [0, 1) for omega, theta, xb and the xf offset
+    rng = np.random.default_rng(seed)
+    if method == "random":
+        return rng.random((n, 4))
+    if method == "stratified":
+        strata = np.stack([rng.permutation(n) for _ in range(4)], axis=1)
+        return (strata + rng.random((n, 4))) / n
+    if method == "sobol":
+        from scipy.stats import qmc
+        return qmc.Sobol(d=4, scramble=True, seed=seed).random(n)
+    raise ValueError("unknown sampling method " + str(method) + ", expected one of " + str(methods))
+
+
+def generate_states(config, n, method="random", seed=0, physics=None):
+    # physics is an optional (n, physics_dimension) table, the wheels of row i are placed its l apart
+    if not config["randomised_state"]:
+        return bike_core.reset(config, n, physics=physics)
+    wheelbase = bike_core.wheelbase(physics)
+    u = unit_samples(n, method, seed)
+    # keep the normal draws finite at the edges of the unit cube
+    u[:, :2] = np.clip(u[:, :2], 1e-12, 1 - 1e-12)
+    inverse_normal = np.vectorize(NormalDist().inv_cdf)
+    omega = inverse_normal(u[:, 0:1]) * np.pi / 180
+    theta = inverse_normal(u[:, 1:2]) * np.pi / 180
+    xb = -60 + 120 * u[:, 2:3]
+    xf = xb + (u[:, 3:4] * wheelbase - 0.5 * wheelbase) / 2  # halved it for psi
+    return bike_core.initial_states(config, omega, theta, xb, xf, physics)
+
+
+def fit(config, states, physics=None):
+    # bank states (n, 12) for the bikes of config: at rest like reset() when config does not randomise the state,
+    # otherwise the same roll, handle bar and back wheel with the front wheel offset scaled to each row's wheelbase
+    if not config["randomised_state"]:
+        return bike_core.reset(config, states.shape[0], physics=physics)
+    xb = states[:, 7:8]
+    xf = xb + (states[:, 5:6] - xb) * bike_core.wheelbase(physics) / bike_core.l
+    return bike_core.initial_states(config, states[:, 0:1], states[:, 3:4], xb, xf, physics)
+
+
+def write_bank(path, config, n, method="random", seed=0, block=1 << 16):
+    # written block by block into a memory mapped file, so the pool never has to fit in memory twice
+    bank = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=(n, bike_core.state_dimension))
+    if method == "random":
+        for start in range(0, n, block):
+            bank[start:start + block] = generate_states(config, min(block, n - start), method, seed + start)
+    else:
+        # stratification and Sobol balance only hold over the whole pool
+        bank[:] = generate_states(config, n, method, seed)
+    bank.flush()
+    return open_bank(path)
+
+
+def open_bank(path):
+    return np.load(path, mmap_mode="r")
+
+
+class state_bank:
+    def __init__(self, path, offset=0):
+        self.states = open_bank(path)
+        self.size = self.states.shape[0]
+        self.cursor = offset
+
+    def take(self, shape):
+        # the next prod(shape[:-1]) states in bank order, wrapping around at the end of the pool.  Two trials that
+        # start at the same offset see identical start sets.
+        n = int(np.prod(shape[:-1]))
+        index = (self.cursor + np.arange(n)) % self.size
+        self.cursor = (self.cursor + n) % self.size
+        return np.array(self.states[index]).reshape(shape)
+
+
+def refill(states, crashed, device_bank, cursor):
+    # O(1) per row: row i of a crashed batch takes bank state (cursor + i) mod bank size.  states is (batch, 12),
+    # crashed is (batch,) and cursor a scalar int tensor that the caller advances by the batch size.
+    index = tf.math.floormod(cursor + tf.range(tf.shape(states)[0]), tf.shape(device_bank)[0])
+    return tf.where(tf.expand_dims(crashed, 1), tf.gather(device_bank, index), states)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write a bank of bike initial states')
+    parser.add_argument('--path', type=str, default="banks/initial_states.npy")
+    parser.add_argument('--size', type=int, default=1 << 20)
+    parser.add_argument('--method', type=str, default="random", choices=methods)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--randomised_state', type=int, default=1)
+    args = parser.parse_args()
+    config = bike_core.default_config()
+    config["randomised_state"] = bool(args.randomised_state)
+    os.makedirs(os.path.dirname(args.path) or ".", exist_ok=True)
+    bank = write_bank(args.path, config, args.size, args.method, args.seed)
+    print("wrote", bank.shape, "initial states to", args.path)
@@ -0,0 +1,182 @@
+import sys
+import time
+import functools
+import argparse
+import numpy as np
+import tensorflow as tf
+import bike_core
+
+# Lookup tables for the handle bar geometry of bike_core.step().  With the nominal bike (no physics table) the lean
+# coupling sign(theta) (m_d r (1 / r_f + 1 / r_b) + m h / r_cm) and the two wheel arc angles asin(v dt / 2 r) depend on
+# theta only, so instead of sin, tan, sqrt and two asin per row per step they are read from cubic Hermite tables on a
+# uniform theta grid.  The tables store values and slopes, so the lookup is C1 and differentiable in theta.
+#  - the coupling is smooth and odd over the whole handle bar range, written without the radii it is
+#    m_d r (sin + tan) / l + m h tan / sqrt((l - c)^2 tan^2 + l^2)
+#  - the arcs are even with a kink at theta = 0, so they are tabulated over |theta|
+# At exactly theta == 0 the lookup returns what step() returns for its 1e8 radius sentinel.  Outside the clip range of
+# step() (|theta| > 1.3963, only possible in a start state) the table holds the value at the edge.
+# Turned on with config["steering_table"] = number of grid points, see population_bike.py --steering_table.
+parser = argparse.ArgumentParser(description='Error bound and speed of the steering geometry tables')
+parser.add_argument('--points', type=int, default=4097)
+parser.add_argument('--batch', type=int, default=1000)
+parser.add_argument('--steps', type=int, default=1000)
+parser.add_argument('--repeats', type=int, default=5)
+parser.add_argument('--check', type=int, default=0, help="only check the tables against bike_core.steering_terms")
+theta_limit = 1.3963  # step() clips the handle bar here
+
+
+def smooth_terms(theta):
+    # values and slopes of coupling(theta) and of the arcs as functions of |theta|, without the theta == 0 sentinel.
+    # Plain NumPy with the derivatives written out, so a table can be built while step() is being traced.
+    b = bike_core
+    tan_theta, sec2_theta = np.tan(theta), 1. / np.cos(theta) ** 2
+    radius2 = (b.l - b.c) ** 2 * tan_theta ** 2 + b.l ** 2
+    coupling = b.m_d * b.r * (np.sin(theta) + tan_theta) / b.l + b.m * b.h * tan_theta / np.sqrt(radius2)
+    coupling_slope = (b.m_d * b.r * (np.cos(theta) + sec2_theta) / b.l
+                      + b.m * b.h * sec2_theta * b.l ** 2 / radius2 ** 1.5)
+    k = b.v * b.delta_time / (2. * b.l)
+    front_arc = np.arcsin(k * np.sin(theta))
+    front_slope = k * np.cos(theta) / np.sqrt(1. - (k * np.sin(theta)) ** 2)
+    back_arc = np.arcsin(k * tan_theta)
+    back_slope = k * sec2_theta / np.sqrt(1. - (k * tan_theta) ** 2)
+    return [coupling, front_arc, back_arc], [coupling_slope, front_slope, back_slope]
+
+
+class steering_table:
+    def __init__(self, points=4097, limit=theta_limit):
+        # an odd number of points puts a knot exactly on theta = 0, where the arc tables start
+        assert points >= 3 and points % 2 == 1, "steering tables need an odd number of points, got " + str(points)
+        self.points = points
+        self.limit = limit
+        self.spacing = 2 * limit / (points - 1)
+        # the arcs use the non negative half of the same grid, the coupling all of it
+        self.half = (points - 1) // 2 + 1
+        values, slopes = smooth_terms(np.linspace(-limit, limit, points))
+        values = [values[0], values[1][-self.half:], values[2][-self.half:]]
+        slopes = [slopes[0], slopes[1][-self.half:], slopes[2][-self.half:]]
+        # lifted out of any graph being traced, so every graph shares the constants
+        with tf.init_scope():
+            self.values = [tf.constant(x, tf.float64) for x in values]
+            self.slopes = [tf.constant(x, tf.float64) for x in slopes]
+            # what step() computes at exactly theta == 0
+            self.sentinel = [x[0] for x in bike_core.steering_terms(tf.zeros([1], tf.float64),
+                                                                    bike_core.derived_physics())]
+
+    def interpolate(self, x, start, values, slopes):
+        # cubic Hermite on the uniform grid starting at start
+        u = (tf.clip_by_value(x, start, self.limit) - start) / self.spacing
+        index = tf.clip_by_value(tf.floor(u), 0., float(values.shape[0] - 2))
+        t = u - index
+        index = tf.cast(index, tf.int32)
+        y0, y1 = tf.gather(values, index), tf.gather(values, index + 1)
+        m0, m1 = tf.gather(slopes, index) * self.spacing, tf.gather(slopes, index + 1) * self.spacing
+        t2, t3 = t * t, t * t * t
+        return (2 * t3 - 3 * t2 + 1) * y0 + (t3 - 2 * t2 + t) * m0 + (3 * t2 - 2 * t3) * y1 + (t3 - t2) * m1
+
+    def __call__(self, theta):
+        # (coupling, front_arc, back_arc) like bike_core.steering_terms
+        coupling = self.interpolate(theta, -self.limit, self.values[0], self.slopes[0])
+        front_arc = self.interpolate(tf.abs(theta), 0., self.values[1], self.slopes[1])
+        back_arc = self.interpolate(tf.abs(theta), 0., self.values[2], self.slopes[2])
+        zero = theta == 0.
+        return [tf.where(zero, sentinel * tf.ones_like(term), term)
+                for sentinel, term in zip(self.sentinel, [coupling, front_arc, back_arc])]
+
+
+@functools.lru_cache(maxsize=None)
+def shared_table(points):
+    # one table per grid size, built the first time step() is traced with it
+    return steering_table(points)
+
+
+def error_bound(table, oversampling=16):
+    # largest absolute error of value and slope against the analytic path, sampled densely inside every interval.
+    # The Hermite error peaks inside the intervals, so 16 samples per interval come close to the true maximum.
+    theta = tf.constant(np.linspace(-table.limit, table.limit, (table.points - 1) * oversampling + 1), tf.float64)
+    with tf.GradientTape(persistent=True) as tape:
+        tape.watch(theta)
+        exact = bike_core.steering_terms(theta, bike_core.derived_physics())
+        approximate = table(theta)
+    errors = {}
+    for name, e, a in zip(["coupling", "front_arc", "back_arc"], exact, approximate):
+        errors[name] = float(tf.reduce_max(tf.abs(e - a)))
+        errors[name + "_slope"] = float(tf.reduce_max(tf.abs(tape.gradient(e, theta) - tape.gradient(a, theta))))
+    # what that means for one Euler step: omega_dot through the coupling, wheel positions through the arcs
+    errors["omega_dot_per_step"] = bike_core.v ** 2 * errors["coupling"] * bike_core.delta_time / bike_core.inertia_bc
+    errors["position_per_step"] = bike_core.v * bike_core.delta_time * max(errors["front_arc"], errors["back_arc"])
+    return errors
+
+
+def check(points=65):
+    # the tables against bike_core.steering_terms: values and slopes exact on the knots, and between the knots errors
+    # that shrink like a cubic Hermite's (values about 16x, slopes about 8x per halved spacing)
+    table = steering_table(points)
+    knots = tf.constant(np.linspace(-table.limit, table.limit, points)[np.arange(points) != (points - 1) // 2])
+    with tf.GradientTape(persistent=True) as tape:
+        tape.watch(knots)
+        exact = bike_core.steering_terms(knots, bike_core.derived_physics())
+        approximate = table(knots)
+    for name, e, a in zip(["coupling", "front_arc", "back_arc"], exact, approximate):
+        scale = 1. + float(tf.reduce_max(tf.abs(tape.gradient(e, knots))))
+        assert np.allclose(a, e, rtol=1e-12, atol=1e-12), name + " differs on the knots"
+        assert np.allclose(tape.gradient(a, knots), tape.gradient(e, knots), rtol=1e-9, atol=1e-9 * scale), \
+            name + " slope differs on the knots"
+    coarse, fine = error_bound(table), error_bound(steering_table(2 * points - 1))
+    for name in ["coupling", "front_arc", "back_arc"]:
+        assert fine[name] <= coarse[name] / 8 or fine[name] < 1e-15, name + " does not converge"
+        assert fine[name + "_slope"] <= coarse[name + "_slope"] / 4 or fine[name + "_slope"] < 1e-12, \
+            name + " slope does not converge"
+    return coarse
+
+
+def benchmark(points, batch, steps, repeats):
+    # seconds per step() call of a batch, analytic against tables, forward only and with the gradient of one step
+    config = bike_core.default_config()
+    config["pseudo_trajectory_length"] = steps + 1
+    rng = np.random.default_rng(0)
+    start_states = tf.constant(bike_core.reset(config, batch, rng))
+    actions = tf.constant(rng.uniform(-1., 1., (batch, bike_core.action_space(config))))
+    weights = tf.constant(bike_core.reward_weights(config))
+    goal_position = tf.constant(bike_core.goal_positions(config, batch))
+    result = {}
+    for name, table_points in [("analytic", 0), ("table", points)]:
+        step_config = dict(config, steering_table=table_points)
+
+        @tf.function
+        def run(state):
+            for _ in tf.range(steps):
+                state = bike_core.step(state, actions, batch, step_config, goal_position, weights)[1]
+            return state
+
+        @tf.function
+        def gradient(state):
+            with tf.GradientTape() as tape:
+                tape.watch(state)
+                reward = bike_core.step(state, actions, batch, step_config, goal_position, weights)[0]
+            return tape.gradient(reward, state)
+        for kind, function, calls in [("step", run, steps), ("gradient", gradient, 1)]:
+            function(start_states).numpy()
+            seconds = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                function(start_states).numpy()
+                seconds.append(time.perf_counter() - start)
+            result[name + "_" + kind] = float(np.median(seconds)) / calls
+    return result
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.check:
+        check()
+        print("steering tables match bike_core.steering_terms")
+        sys.exit()
+    table = steering_table(args.points)
+    print("grid of", args.points, "points, spacing %.2e rad" % table.spacing)
+    for name, error in error_bound(table).items():
+        print("max error %-20s %.3e" % (name, error))
+    result = benchmark(args.points, args.batch, args.steps, args.repeats)
+    for kind in ["step", "gradient"]:
+        print("%-8s analytic %8.1f us  table %8.1f us  speedup %.2f" % (
+            kind, 1e6 * result["analytic_" + kind], 1e6 * result["table_" + kind],
+            result["analytic_" + kind] / result["table_" + kind]))
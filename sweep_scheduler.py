@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import glob
+import math
+import argparse
+import itertools
+import subprocess
+import numpy as np
+from multiprocessing.pool import ThreadPool
+import bike_core
+from experiment_catalog import parse_name
+
+# Successive halving over a sweep of population_bike.py configurations.  Every (trial, use_tanh, with_psi_restriction,
+# randomised_state, test) combination first trains for --min_iterations.  The configurations are ranked by the mean
+# reward_history of their last --window iterations (mean timestep_history breaks ties) and only the best 1 / --eta
+# go on to a budget --eta times larger, until --max_iterations.  Budgets are cumulative: a promoted configuration
+# continues from its checkpoint and results with population_bike.py --resume, it is not restarted.  The state of the
+# sweep lives in the runs/ results files, so an interrupted sweep picks up where it stopped when run again.
+parser = argparse.ArgumentParser(description='Successive halving sweep over population_bike.py configurations')
+parser.add_argument('--sweep_name', type=str, default="sweep")
+parser.add_argument('--trials', type=int, default=3)
+parser.add_argument('--use_tanh', type=str, default="0,1")
+parser.add_argument('--with_psi_restriction', type=str, default="0,1")
+parser.add_argument('--randomised_state', type=str, default="0,1")
+parser.add_argument('--test', type=str, default="psiRemoved")
+parser.add_argument('--min_iterations', type=int, default=50)
+parser.add_argument('--max_iterations', type=int, default=1350)
+parser.add_argument('--eta', type=int, default=3)
+parser.add_argument('--window', type=int, default=20)
+parser.add_argument('--workers', type=int, default=1, help="trainer processes running at the same time")
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--trainer_args', type=str, default="", help="extra arguments passed to every trainer run")
+parser.add_argument('--output', type=str, default="")
+
+
+def sweep_configs(args):
+    configs = []
+    for trial, use_tanh, with_psi_restriction, randomised_state, test in itertools.product(
+            range(args.trials), *[[int(x) for x in values.split(",")] for values in [
+                args.use_tanh, args.with_psi_restriction, args.randomised_state]], args.test.split(",")):
+        config = dict(bike_core.default_config(), use_tanh=use_tanh, with_psi_restriction=with_psi_restriction,
+                      randomised_state=randomised_state, test=test)
+        # one trainer process and trial name per configuration, so its checkpoint and results belong to it alone
+        config["trial_name"] = "%s_%d_%d" % (args.sweep_name, len(configs), trial)
+        config["seed"] = args.seed + trial
+        config["filename"] = bike_core.run_filename(config["trial_name"] + "_policy_0", config)
+        configs.append(config)
+    return configs
+
+
+def history(config):
+    # reward_history and timestep_history of the whole run so far, (2, iterations), from the results files
+    paths = glob.glob("runs/" + config["trial_name"] + "_marker_*_results_" + config["filename"] + ".npy")
+    paths = sorted(paths, key=lambda path: parse_name(path)["marker"])
+    if not paths:
+        return np.zeros((2, 0))
+    return np.concatenate([np.load(path, allow_pickle=True).reshape(2, -1) for path in paths], axis=1)
+
+
+def score(config, window):
+    # higher is better, runs without results rank last
+    results = history(config)
+    if results.shape[1] == 0:
+        return (-np.inf, -np.inf)
+    recent = results[:, -window:].astype(np.float64)
+    return (float(np.mean(recent[0])), float(np.mean(recent[1])))
+
+
+def train(config, iterations, trainer_args):
+    # runs (or continues) one configuration until it has trained for iterations in total
+    if history(config).shape[1] >= iterations:
+        return 0
+    command = [sys.executable, "population_bike.py", "--trialname", config["trial_name"], "--population", "1",
+               "--use_tanh", str(config["use_tanh"]), "--with_psi_restriction", str(config["with_psi_restriction"]),
+               "--randomised_state", str(config["randomised_state"]), "--test", config["test"],
+               "--seed", str(config["seed"]), "--max_iterations", str(iterations), "--resume", "1",
+               # a throughput profile could rename the trial, its results are looked up by config["trial_name"]
+               "--profile", ""]
+    with open(os.path.join("runs", config["trial_name"] + ".log"), "a") as log:
+        return subprocess.run(command + trainer_args.split(), stdout=log, stderr=subprocess.STDOUT).returncode
+
+
+def successive_halving(configs, min_iterations, max_iterations, eta=3, window=20, workers=1, trainer_args=""):
+    # returns one entry per rung with the budget, the scores of the configurations in it and the promoted ones
+    os.makedirs("runs", exist_ok=True)
+    alive = list(configs)
+    budget = min(min_iterations, max_iterations)
+    rungs = []
+    while True:
+        with ThreadPool(workers) as pool:
+            codes = pool.map(lambda config: train(config, budget, trainer_args), alive)
+        for config, code in zip(alive, codes):
+            if code:
+                print("trainer failed for", config["trial_name"], "see runs/" + config["trial_name"] + ".log")
+        ranked = sorted(alive, key=lambda config: score(config, window), reverse=True)
+        keep = max(1, math.ceil(len(ranked) / eta))
+        rungs.append({"budget": budget, "scores": {config["trial_name"]: score(config, window) for config in ranked},
+                      "promoted": [config["trial_name"] for config in ranked[:keep]]})
+        print("budget", budget, "iterations:", len(ranked), "configurations, best",
+              ranked[0]["filename"], "%.3f reward %.1f steps" % score(ranked[0], window))
+        if budget >= max_iterations or len(ranked) == 1:
+            return rungs
+        alive = ranked[:keep]
+        budget = min(budget * eta, max_iterations)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    configs = sweep_configs(args)
+    total = len(configs) * args.max_iterations
+    rungs = successive_halving(configs, args.min_iterations, args.max_iterations, args.eta, args.window, args.workers,
+                               args.trainer_args)
+    spent = sum(min(history(config).shape[1], args.max_iterations) for config in configs)
+    print("trained %d iterations, %.1f%% of running every configuration to the end" % (spent, 100. * spent / total))
+    best = {config["trial_name"]: config for config in configs}[rungs[-1]["promoted"][0]]
+    print("best configuration:", best["filename"])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"configs": configs, "rungs": rungs}, f, indent=1, default=str)
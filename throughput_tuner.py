@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import socket
+import resource
+import argparse
+import itertools
+import subprocess
+import numpy as np
+import tensorflow as tf
+import bike_core
+
+# Host specific throughput autotuner.  Candidate (pseudo_batch_size, trajectory_length, chunks, intra_op, inter_op)
+# tuples are each measured in a fresh process, because the TF thread pools can only be sized before the runtime
+# starts.  The child traces the learning step of the trainers for that batch layout, runs it for --seconds, and
+# reports bike steps per second (population * pseudo_batch_size * chunks * trajectory_length per learning step) and
+# its peak resident memory.  The trainer defaults are measured first, the other candidates in a seeded random order
+# until the time budget is spent.  The fastest candidate within --max_memory_mb is written to the profile, which
+# population_bike.py loads on start when it was measured on the same host (unless run with --profile "").
+parser = argparse.ArgumentParser(description='Measure training throughput on this host and write the best profile')
+parser.add_argument('--budget', type=float, default=600., help="seconds for the whole search")
+parser.add_argument('--seconds', type=float, default=5., help="timed seconds per candidate after tracing")
+parser.add_argument('--population', type=int, default=1)
+parser.add_argument('--pseudo_batch_sizes', type=str, default="10,32,100,320")
+parser.add_argument('--trajectory_lengths', type=str, default="2,5,10,20,50")
+parser.add_argument('--chunks', type=str, default="1,5,10")
+parser.add_argument('--intra_op', type=str, default="", help="default 1, physical and logical cpus")
+parser.add_argument('--inter_op', type=str, default="1,2")
+parser.add_argument('--max_memory_mb', type=float, default=float("inf"))
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--profile', type=str, default="throughput_profile.json")
+parser.add_argument('--measure', type=str, default="", help=argparse.SUPPRESS)
+knobs = ["pseudo_batch_size", "trajectory_length", "chunks", "intra_op", "inter_op"]
+
+
+def host_description():
+    return {"host": socket.gethostname(), "cpus": os.cpu_count(), "tensorflow": tf.__version__}
+
+
+def candidates(args):
+    cpus = os.cpu_count() or 1
+    intra_op = [int(x) for x in args.intra_op.split(",")] if args.intra_op else sorted({1, max(1, cpus // 2), cpus})
+    grid = list(itertools.product(*[[int(x) for x in values.split(",")] for values in [
+        args.pseudo_batch_sizes, args.trajectory_lengths, args.chunks]], intra_op,
+                                  [int(x) for x in args.inter_op.split(",")]))
+    np.random.default_rng(args.seed).shuffle(grid)
+    # the layout the trainer uses without a profile, with TF's own thread pools (0)
+    config = bike_core.default_config()
+    default = (config["pseudo_batch_size"], config["trajectory_length"], bike_core.chunks(config), 0, 0)
+    return [dict(zip(knobs, candidate)) for candidate in [default] + [c for c in grid if c != default]]
+
+
+def measure(candidate, population, seconds):
+    # runs in the child process, before anything else touches the TF runtime
+    tf.config.threading.set_intra_op_parallelism_threads(candidate["intra_op"])
+    tf.config.threading.set_inter_op_parallelism_threads(candidate["inter_op"])
+    config = bike_core.default_config()
+    config.update(pseudo_batch_size=candidate["pseudo_batch_size"], trajectory_length=candidate["trajectory_length"],
+                  pseudo_trajectory_length=candidate["trajectory_length"] * candidate["chunks"])
+    rows = population * bike_core.batch_size(config)
+    network = bike_core.build_network(config)
+    weights = tf.constant(bike_core.reward_weights(config))
+    goal_position = tf.constant(bike_core.goal_positions(config, rows))
+    start_states = tf.constant(bike_core.reset(config, rows))
+    final_artificial_gradient = tf.zeros_like(start_states)
+
+    @tf.function
+    def learn(start_states, final_artificial_gradient):
+        with tf.GradientTape() as tape:
+            tape.watch(start_states)
+            total_rewards = bike_core.expand_trajectories(network, start_states, final_artificial_gradient, rows,
+                                                          config, goal_position, weights)[0]
+            cost_ = -tf.reduce_mean(total_rewards)
+        return tape.gradient(cost_, [start_states] + network.trainable_weights)
+    start = time.perf_counter()
+    [x.numpy() for x in learn(start_states, final_artificial_gradient)]
+    trace_seconds = time.perf_counter() - start
+    steps = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds or steps < 3:
+        [x.numpy() for x in learn(start_states, final_artificial_gradient)]
+        steps += 1
+    step_seconds = (time.perf_counter() - start) / steps
+    return dict(candidate, trace_seconds=trace_seconds, step_seconds=step_seconds,
+                bike_steps_per_second=rows * config["trajectory_length"] / step_seconds,
+                peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
+
+
+def search(args):
+    deadline = time.perf_counter() + args.budget
+    results = []
+    for candidate in candidates(args):
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        try:
+            output = subprocess.run([sys.executable, __file__, "--measure", json.dumps(candidate), "--population",
+                                     str(args.population), "--seconds", str(args.seconds)], check=True,
+                                    capture_output=True, text=True, timeout=remaining).stdout
+        except subprocess.TimeoutExpired:
+            print("budget spent while measuring", candidate)
+            break
+        except subprocess.CalledProcessError as error:
+            print("failed", candidate, error.stderr.strip().splitlines()[-1:])
+            continue
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        print(" ".join("%s=%d" % (knob, result[knob]) for knob in knobs),
+              "%.0f bike steps/s, %.0f MB" % (result["bike_steps_per_second"], result["peak_rss_mb"]))
+    return results
+
+
+def best(results, max_memory_mb=float("inf")):
+    fitting = [result for result in results if result["peak_rss_mb"] <= max_memory_mb]
+    return max(fitting, key=lambda result: result["bike_steps_per_second"]) if fitting else None
+
+
+def save_profile(path, choice, results, population):
+    profile = dict(host_description(), population=population, measured=results,
+                   **{key: choice[key] for key in knobs + ["bike_steps_per_second", "peak_rss_mb"]})
+    profile["pseudo_trajectory_length"] = choice["trajectory_length"] * choice["chunks"]
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=1)
+
+
+def load_profile(path):
+    # the profile if it exists and was measured on this host, otherwise None
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        profile = json.load(f)
+    if any(profile.get(key) != value for key, value in host_description().items()):
+        print("ignoring", path, "measured on", profile.get("host"), "with", profile.get("cpus"), "cpus")
+        return None
+    return profile
+
+
+def apply_profile(profile, config):
+    # batch layout into config, thread pools into the runtime, so call before the first TF op
+    config.update(pseudo_batch_size=profile["pseudo_batch_size"], trajectory_length=profile["trajectory_length"],
+                  pseudo_trajectory_length=profile["pseudo_trajectory_length"])
+    tf.config.threading.set_intra_op_parallelism_threads(profile["intra_op"])
+    tf.config.threading.set_inter_op_parallelism_threads(profile["inter_op"])
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.measure:
+        print(json.dumps(measure(json.loads(args.measure), args.population, args.seconds)))
+        sys.exit()
+    results = search(args)
+    choice = best(results, args.max_memory_mb)
+    if choice is None:
+        print("no candidate measured within the budget and memory limit, no profile written")
+        sys.exit(1)
+    save_profile(args.profile, choice, results, args.population)
+    print("best:", " ".join("%s=%d" % (knob, choice[knob]) for knob in knobs),
+          "%.0f bike steps/s, written to %s" % (choice["bike_steps_per_second"], args.profile))
+    default = next((result for result in results if result["intra_op"] == 0), None)
+    if default is not None:
+        print("%.2fx the trainer defaults" % (choice["bike_steps_per_second"] / default["bike_steps_per_second"]))
@@ -0,0 +1,36 @@
+import tensorflow as tf
+
+# Per iteration summary statistics computed inside the compiled learning step.  The training loops used to pull the full
+# (T+1, batch, 12) trajectory to the host every iteration only to take a max and a mean of its timestep column and to
+# scan every gradient for NaNs.  summary_metrics() reduces all of that on the device to one small (K, len(metric_names))
+# tensor, one row per policy, and the trajectory is only copied out on logging iterations.
+metric_names = ["max_balance_steps", "mean_balance_steps", "max_reward", "mean_reward", "min_reward",
+                "gradient_norm", "nan_gradients", "nan_states", "terminated"]
+metric_index = {name: i for i, name in enumerate(metric_names)}
+
+
+def per_policy_squared_norms(tensors):
+    # tensors are stacked with the policy on the leading axis, returns (K,) sums of squares
+    return tf.add_n([tf.reduce_sum(tf.square(tf.cast(x, tf.float64)), axis=list(range(1, len(x.shape))))
+                     for x in tensors])
+
+
+def per_policy_all_finite(tensors):
+    return tf.reduce_all(tf.stack([tf.reduce_all(tf.math.is_finite(x), axis=list(range(1, len(x.shape))))
+                                   for x in tensors]), axis=0)
+
+
+def summary_metrics(trajectory, total_rewards, gradients, trajectories_terminated, population):
+    # trajectory (T+1, K * batch, 12), total_rewards (K, batch), gradients stacked (K, ...), terminated (K * batch,)
+    trajectory = tf.reshape(trajectory, [trajectory.shape[0], population, -1, trajectory.shape[-1]])
+    timesteps = trajectory[:, :, :, -1]
+    balance = tf.reduce_max(tf.reduce_max(timesteps, axis=0), axis=1)
+    mean_balance = tf.reduce_mean(timesteps[-1], axis=1)
+    total_rewards = tf.cast(total_rewards, tf.float64)
+    gradient_norm = tf.sqrt(per_policy_squared_norms(gradients))
+    nan_gradients = tf.logical_not(per_policy_all_finite(gradients))
+    nan_states = tf.logical_not(tf.reduce_all(tf.math.is_finite(trajectory), axis=[0, 2, 3]))
+    terminated = tf.reduce_sum(tf.cast(tf.reshape(trajectories_terminated, [population, -1]), tf.float64), axis=1)
+    return tf.stack([balance, mean_balance, tf.reduce_max(total_rewards, axis=1), tf.reduce_mean(total_rewards, axis=1),
+                     tf.reduce_min(total_rewards, axis=1), gradient_norm, tf.cast(nan_gradients, tf.float64),
+                     tf.cast(nan_states, tf.float64), terminated], axis=1)
@@ -0,0 +1,224 @@
+import os
+import json
+import zlib
+import time
+import argparse
+import zipfile
+import numpy as np
+import bike_constants
+
+# Compressed archive for stored trajectories, the (T, batch, 12) float64 arrays the training scripts save as
+# last_state_*.npy and *_trajectory_history_*.npy.  Every column gets its own codec:
+#  - "delta"     quantised to the column's step, differenced along time and stored in the narrowest of int8, int16 and
+#                int32 that holds the block's differences (codecs "delta8", "delta16", "delta"; error at most step / 2)
+#  - "float32"   plain float32, the fallback
+#  - "timestep"  the timestep column only ever grows by one or freezes, so it is the first value plus 0/1 increments
+#  - "wheel"     x_b and y_b are dropped and rebuilt from x_f, y_f, psi and the wheelbase l, unless the rows have
+#                different wheelbases (append with wheelbase=None), then they are stored with the delta codec
+# A block that a codec cannot represent (non-finite values, a timestep column that is not a counter) falls back to
+# float32.  The encoded columns of a block are byte shuffled, joined and zlib compressed as one zip member per
+# iteration and block of batch rows, so one iteration or a few rows can be read without decompressing the rest.
+# On the stored runs (withClipping/ and trials/) this is 12.8x smaller than the .npy files, but reading is about
+# 15x slower than np.load from a warm page cache (which is a plain copy), so it pays off when storage or the
+# network, not decoding, is the bottleneck.
+codecs = {"omega": "delta", "omega_dot": "delta", "omega_ddot": "delta", "theta": "delta", "theta_dot": "delta",
+          "x_f": "delta", "y_f": "delta", "x_b": "wheel", "y_b": "wheel", "psi": "delta", "psig": "delta",
+          "timestep": "timestep"}
+# angles to 1e-6 rad, rates to 1e-5 rad/s, positions to 0.1 mm (the rebuilt back wheel is only good to 0.01 m anyway)
+quantisation_steps = {"omega": 1e-6, "omega_dot": 1e-5, "omega_ddot": 1e-4, "theta": 1e-6, "theta_dot": 1e-5,
+                      "x_f": 1e-4, "y_f": 1e-4, "x_b": 1e-4, "y_b": 1e-4, "psi": 1e-6, "psig": 1e-6}
+delta_types = {"delta8": np.int8, "delta16": np.int16, "delta": np.int32}
+
+
+def shuffle_bytes(array):
+    # byte planes of a fixed width array, the high bytes of nearby values are alike and compress well
+    return np.ascontiguousarray(array.view(np.uint8).reshape(-1, array.dtype.itemsize).T).tobytes()
+
+
+def unshuffle_bytes(data, dtype, shape):
+    dtype = np.dtype(dtype)
+    planes = np.frombuffer(data, np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+
+
+def encode(codec, column, step=None):
+    # column is (T, rows) float64, returns the codec actually used and the bytes, or None
+    if codec == "delta":
+        if not np.all(np.isfinite(column)):
+            return None
+        quantised = np.round(column / step).astype(np.int64)
+        deltas = np.diff(quantised, axis=0, prepend=0)
+        largest = np.abs(deltas).max(initial=0)
+        for codec, dtype in delta_types.items():
+            if largest <= np.iinfo(dtype).max:
+                return codec, shuffle_bytes(deltas.astype(dtype))
+        return None  # the step is too fine for this column
+    if codec == "float32":
+        return codec, shuffle_bytes(column.astype(np.float32))
+    if codec == "timestep":
+        increments = np.diff(column, axis=0)
+        if np.all((increments == 0) | (increments == 1)):
+            return codec, column[0].astype(np.float64).tobytes() + np.packbits(increments.astype(np.uint8)).tobytes()
+        return None  # not a plain step counter
+    raise ValueError("no encoder for codec " + codec)
+
+
+def decode(codec, data, shape, step=None):
+    if codec in delta_types:
+        return np.cumsum(unshuffle_bytes(data, delta_types[codec], shape), axis=0, dtype=np.int64) * step
+    if codec == "float32":
+        return unshuffle_bytes(data, np.float32, shape).astype(np.float64)
+    if codec == "timestep":
+        rows = shape[1]
+        start = np.frombuffer(data[:8 * rows], np.float64)
+        increments = np.unpackbits(np.frombuffer(data[8 * rows:], np.uint8))[:(shape[0] - 1) * rows]
+        increments = increments.reshape(shape[0] - 1, rows).astype(np.float64)
+        return start + np.concatenate([np.zeros((1, rows)), np.cumsum(increments, axis=0)])
+    raise ValueError("no decoder for codec " + codec)
+
+
+def rebuild_back_wheel(x_f, y_f, psi, l=bike_constants.l):
+    # psi = atan((x_b - x_f) / (y_f - y_b)) with the wheels l apart.  step() only corrects the wheelbase once it drifts
+    # by more than 0.01, so the rebuilt position is within about that distance of the stored one.
+    return x_f + l * np.sin(psi), y_f - l * np.cos(psi)
+
+
+def member(iteration, *parts):
+    return "/".join(str(x) for x in (iteration,) + parts)
+
+
+class trajectory_archive:
+    def __init__(self, path, mode="r", row_block=256, steps=None, level=6):
+        # mode "w" creates a new archive, "a" appends to one, "r" reads.  steps overrides quantisation_steps per column.
+        self.path = path
+        self.row_block = row_block
+        self.steps = dict(quantisation_steps, **(steps or {}))
+        self.level = level
+        self.zip = zipfile.ZipFile(path, mode, compression=zipfile.ZIP_STORED, allowZip64=True)
+        self.meta = {}
+        for name in self.zip.namelist():
+            if name.endswith("/meta.json"):
+                meta = json.loads(self.zip.read(name))
+                self.meta[meta["iteration"]] = meta
+
+    def iterations(self):
+        return sorted(self.meta)
+
+    def append(self, iteration, trajectory, wheelbase=bike_constants.l):
+        # wheelbase None keeps x_b and y_b, for rows whose bikes are not all l long
+        trajectory = np.asarray(trajectory, np.float64)
+        assert iteration not in self.meta, "iteration " + str(iteration) + " is already archived"
+        steps, rows, _ = trajectory.shape
+        meta = {"iteration": iteration, "steps": steps, "rows": rows, "row_block": self.row_block,
+                "quantisation_steps": self.steps, "wheelbase": wheelbase, "codecs": []}
+        for block, start in enumerate(range(0, rows, self.row_block)):
+            # [name, codec, bytes] in member order
+            block_codecs = []
+            parts = []
+            for i, name in enumerate(bike_constants.state_columns):
+                codec = codecs[name]
+                if codec == "wheel":
+                    if wheelbase is not None:
+                        continue
+                    codec = "delta"
+                column = trajectory[:, start:start + self.row_block, i]
+                encoded = encode(codec, column, self.steps.get(name))
+                codec, data = encoded if encoded is not None else encode("float32", column)
+                block_codecs.append([name, codec, len(data)])
+                parts.append(data)
+            self.zip.writestr(member(iteration, block), zlib.compress(b"".join(parts), self.level))
+            meta["codecs"].append(block_codecs)
+        self.zip.writestr(member(iteration, "meta.json"), json.dumps(meta))
+        self.meta[iteration] = meta
+
+    def read(self, iteration, rows=None):
+        # (T, len(rows), 12) float64, rows default to the whole batch
+        meta = self.meta[iteration]
+        rows = np.arange(meta["rows"]) if rows is None else np.asarray(rows)
+        block_size = meta["row_block"]
+        columns = bike_constants.state_columns
+        result = np.empty((meta["steps"], len(rows), bike_constants.state_dimension))
+        for block in np.unique(rows // block_size):
+            start = block * block_size
+            shape = (meta["steps"], min(block_size, meta["rows"] - start))
+            # column major while decoding, so every column is written contiguously
+            decoded = np.empty((bike_constants.state_dimension,) + shape)
+            data = memoryview(zlib.decompress(self.zip.read(member(iteration, block))))
+            offset = 0
+            for name, codec, size in meta["codecs"][block]:
+                decoded[columns.index(name)] = decode(codec, data[offset:offset + size], shape,
+                                                      meta["quantisation_steps"].get(name))
+                offset += size
+            if meta["wheelbase"] is not None:
+                decoded[columns.index("x_b")], decoded[columns.index("y_b")] = rebuild_back_wheel(
+                    decoded[columns.index("x_f")], decoded[columns.index("y_f")], decoded[columns.index("psi")],
+                    meta["wheelbase"])
+            selected = np.flatnonzero(rows // block_size == block)
+            if len(selected) == shape[1] and np.all(np.diff(rows[selected]) == 1) and rows[selected[0]] == start:
+                # the whole block in order, a plain strided copy instead of fancy indexing
+                result[:, selected[0]:selected[0] + shape[1]] = decoded.transpose(1, 2, 0)
+            else:
+                result[:, selected] = decoded[:, :, rows[selected] - start].transpose(1, 2, 0)
+        return result
+
+    def close(self):
+        self.zip.close()
+
+
+def archive_files(paths, output):
+    # each .npy is either one (T, batch, 12) trajectory or a (iterations, T, batch, 12) history
+    archive = trajectory_archive(output, "w")
+    raw_bytes = 0
+    iteration = 0
+    for path in paths:
+        array = np.load(path, allow_pickle=True)
+        raw_bytes += array.nbytes
+        for trajectory in (array if array.ndim == 4 else [array]):
+            archive.append(iteration, trajectory)
+            iteration += 1
+    archive.close()
+    return raw_bytes
+
+
+def timed(function, repeats=5):
+    # median seconds after one warm up call, and the result
+    result = function()
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return float(np.median(seconds)), result
+
+
+def benchmark(paths, output):
+    raw_bytes = sum(os.path.getsize(path) for path in paths)
+    archive_files(paths, output)
+
+    def load_raw():
+        return [np.load(path, allow_pickle=True) for path in paths]
+
+    def load_archive():
+        archive = trajectory_archive(output)
+        return [archive.read(i) for i in archive.iterations()]
+    raw_seconds, original = timed(load_raw)
+    archive_seconds, restored = timed(load_archive)
+    original = [trajectory for x in original for trajectory in (x if x.ndim == 4 else [x])]
+    error = np.max([np.abs(r - o).max(axis=(0, 1)) for r, o in zip(restored, original)], axis=0)
+    archive_bytes = os.path.getsize(output)
+    print("raw %d bytes, archive %d bytes, %.1fx smaller" % (raw_bytes, archive_bytes, raw_bytes / archive_bytes))
+    print("load %.4fs raw, %.4fs archive" % (raw_seconds, archive_seconds))
+    for name, column_error in zip(bike_constants.state_columns, error):
+        print("%-10s max abs error %.3g" % (name, column_error))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pack stored trajectories into a compressed archive')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--output', type=str, default="trajectories.zip")
+    parser.add_argument('--benchmark', type=int, default=0)
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.paths, args.output)
+    else:
+        archive_files(args.paths, args.output)
@@ -0,0 +1,179 @@
+import os
+import glob
+import shutil
+import functools
+import argparse
+import subprocess
+import multiprocessing
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+import bike_constants
+from trajectory_archive import trajectory_archive
+
+# Offline renderer for stored runs, with the eight panels of the training scripts' dynamic_graphics.  Each panel draws
+# all batch rows as one LineCollection instead of one ax.plot per row, and the direction arrows of the path panel come
+# from a single arc-length pass over every row followed by one quiver call.  Frames (one per stored iteration) are
+# rendered by a process pool to PNG, and optionally joined into a video with ffmpeg.  Workers open the inputs memory
+# mapped and each worker opens an archive once, so only the frame index travels between processes.  Nothing here
+# imports TensorFlow, a spawned worker starts in well under a second.
+parser = argparse.ArgumentParser(description='Render stored trajectories to PNG frames and video')
+parser.add_argument('--trajectories', type=str, required=True,
+                    help="(T, batch, 12) or (iterations, T, batch, 12) .npy, or a trajectory_archive .zip")
+parser.add_argument('--actions', type=str, default="", help="matching (T, batch, 2) or (iterations, T, batch, 2) .npy")
+parser.add_argument('--results', type=str, default="", help="glob of *_results_*.npy files with reward/step history")
+parser.add_argument('--output', type=str, default="frames")
+parser.add_argument('--video', type=str, default="")
+parser.add_argument('--fps', type=int, default=10)
+parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+parser.add_argument('--field', type=float, default=60.)
+parser.add_argument('--goal', type=str, default="0,60")
+colors = ['red', 'blue', 'green', 'orange', 'black', 'yellow', 'purple', 'pink', 'olive', 'cyan']
+arrow_locs = [0.2, 0.4, 0.6, 0.8]
+
+
+def row_colors(trajectory):
+    # like dynamic_graphics: a row that starts at timestep 0 begins a new trajectory and takes the next colour
+    starts = np.cumsum(trajectory[0, :, -1] == 0)
+    return [colors[i % len(colors)] for i in starts]
+
+
+def line_collection(axes, x, y, row_color):
+    # x and y are (T, batch), one polyline per batch row
+    collection = LineCollection(np.stack([x.T, y.T], axis=-1), colors=row_color, linewidths=1.)
+    axes.add_collection(collection)
+    return collection
+
+
+def arrows(x, y, locs=arrow_locs):
+    # tails and directions of arrows at fractions of every row's path length, one cumulative sum for all rows
+    length = np.cumsum(np.sqrt(np.diff(x, axis=0) ** 2 + np.diff(y, axis=0) ** 2), axis=0)  # (T - 1, batch)
+    targets = length[-1][None, :] * np.asarray(locs)[:, None]  # (locs, batch)
+    index = np.minimum(np.sum(length[None, :, :] < targets[:, None, :], axis=1), x.shape[0] - 2)
+    rows = np.arange(x.shape[1])[None, :]
+    tail_x, tail_y = x[index, rows], y[index, rows]
+    return tail_x, tail_y, (x[index + 1, rows] - tail_x) / 2, (y[index + 1, rows] - tail_y) / 2
+
+
+# archives of this worker by path, opened by open_archives, the pool initializer
+archives = {}
+
+
+def open_archives(paths):
+    for path in paths:
+        if path.endswith(".zip") and path not in archives:
+            archives[path] = trajectory_archive(path)
+
+
+def frame_count(path):
+    if path.endswith(".zip"):
+        archive = trajectory_archive(path)
+        count = len(archive.iterations())
+        archive.close()
+        return count
+    shape = np.load(path, mmap_mode="r").shape
+    return shape[0] if len(shape) == 4 else 1
+
+
+def load_frame(path, index):
+    # one stored iteration, (T, batch, features), read memory mapped or from its own archive members
+    if path.endswith(".zip"):
+        open_archives([path])
+        archive = archives[path]
+        return archive.read(archive.iterations()[index])
+    array = np.load(path, mmap_mode="r")
+    return np.asarray(array[index] if array.ndim == 4 else array)
+
+
+@functools.lru_cache(maxsize=None)
+def load_results(pattern):
+    # reward and step history over the whole run in marker order, loaded once per worker
+    def marker(path):
+        return int(path.split("_marker_")[1].split("_")[0]) if "_marker_" in path else 0
+    paths = sorted(glob.glob(pattern), key=marker)
+    if not paths:
+        return np.zeros((2, 0))
+    return np.concatenate([np.load(path, allow_pickle=True).reshape(2, -1) for path in paths], axis=1)
+
+
+def render_frame(job):
+    index, args = job
+    trajectory = load_frame(args.trajectories, index)
+    actions = load_frame(args.actions, index) if args.actions else None
+    results = load_results(args.results) if args.results else np.zeros((2, 0))
+    goal = [float(x) for x in args.goal.split(",")]
+    config = bike_constants.default_config()
+    horizon = max(float(np.max(trajectory[:, :, -1])), 1.)
+    time_steps = trajectory[:, :, -1]
+    row_color = row_colors(trajectory)
+    figure, ((ax_omega, ax_theta), (ax_trajectory, ax_reward_history), (ax_actionT, ax_psi),
+             (ax_actiond, ax_timestep)) = plt.subplots(nrows=4, ncols=2, figsize=(10, 10))
+    figure.tight_layout(pad=5.0)
+    pad = 10
+    degrees = 180 / np.pi
+    panels = [(ax_omega, trajectory[:, :, 0] * degrees, 'Bike Roll value in Degrees', '(Bike Roll).',
+               [(-np.pi / 15) * degrees - pad, (np.pi / 15) * degrees + pad]),
+              (ax_theta, trajectory[:, :, 3] * degrees, 'Bike handle value in Degrees', '(Bike Handle).',
+               [-80 - pad, 80 + pad]),
+              (ax_psi, trajectory[:, :, 9] * degrees, 'psi', 'Bike direction Psi', [-180 - pad, 180 + pad])]
+    for axes, values, ylabel, title, limits in panels:
+        line_collection(axes, time_steps, values, row_color)
+        axes.axis([0, horizon] + limits)
+        axes.set(xlabel='timestep', ylabel=ylabel)
+        axes.set_title(title)
+    if actions is not None:
+        torque = np.clip(actions[:, :, 0] * config["maximum_torque"], -config["maximum_torque"],
+                         config["maximum_torque"])
+        displacement = np.clip(actions[:, :, 1] * config["maximum_dis"], -config["maximum_dis"], config["maximum_dis"])
+        line_collection(ax_actionT, time_steps[1:], torque, row_color)
+        line_collection(ax_actiond, time_steps[1:], displacement, row_color)
+    ax_actionT.axis([0, horizon, -2 - 0.5, 2 + 0.5])
+    ax_actionT.set(xlabel='timestep', ylabel='torque')
+    ax_actionT.set_title('Trajectory torque')
+    ax_actiond.axis([0, horizon, -config["maximum_dis"] - 0.01, config["maximum_dis"] + 0.01])
+    ax_actiond.set(xlabel='timestep', ylabel='displacement')
+    ax_actiond.set_title('The centre of mass displacement')
+    x, y = trajectory[:, :, 5], trajectory[:, :, 6]
+    line_collection(ax_trajectory, x, y, row_color)
+    if x.shape[0] > 2:
+        tail_x, tail_y, dx, dy = arrows(x, y)
+        ax_trajectory.quiver(tail_x.ravel(), tail_y.ravel(), dx.ravel(), dy.ravel(), angles='xy', scale_units='xy',
+                             scale=1, color=np.tile(row_color, len(arrow_locs)), width=0.004)
+    ax_trajectory.plot(goal[0], goal[1], color='b', marker='o')
+    ax_trajectory.axis([-args.field, args.field, -args.field, args.field])
+    ax_trajectory.set(xlabel='x', ylabel='y')
+    ax_trajectory.set_title('Bike Trajectory.')
+    ax_reward_history.plot(results[0], color='red')
+    ax_reward_history.set(xlabel='Iteration', ylabel='Reward')
+    ax_reward_history.set_title('Reward over Iteration')
+    ax_timestep.plot(results[1], color='red')
+    ax_timestep.set(xlabel='iteration', ylabel='time steps')
+    ax_timestep.set_title('max balancing duration')
+    for axes in [ax_omega, ax_theta, ax_trajectory, ax_reward_history, ax_actionT, ax_psi, ax_actiond, ax_timestep]:
+        axes.grid()
+    path = os.path.join(args.output, "frame_%06d.png" % index)
+    figure.savefig(path)
+    plt.close(figure)
+    return path
+
+
+def make_video(output, video, fps):
+    if shutil.which("ffmpeg") is None:
+        print("ffmpeg not found, frames are in", output)
+        return
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-framerate", str(fps), "-i",
+                    os.path.join(output, "frame_%06d.png"), "-pix_fmt", "yuv420p", video], check=True)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+    frames = frame_count(args.trajectories)
+    with multiprocessing.get_context("spawn").Pool(max(1, min(args.workers, frames)), open_archives,
+                                                   ([args.trajectories, args.actions],)) as pool:
+        paths = pool.map(render_frame, [(i, args) for i in range(frames)])
+    print("rendered", len(paths), "frames to", args.output)
+    if args.video:
+        make_video(args.output, args.video, args.fps)
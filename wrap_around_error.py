@@ -0,0 +1,137 @@
+import json
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+import bike_core
+from forward_gradients import checkpointed_weight_gradients
+
+# How much gradient accuracy the chunked "wrap-around hack" gives up, and what it buys in speed.  On one sample batch
+# and fixed weights, the exact full horizon weight gradient is computed by BPTT over the whole pseudo trajectory
+# (tf.recompute_grad segments keep the tape small).  For every chunk length the chunked learning step of the trainers
+# is then iterated like training does:
+#  - "truncated": chunks iterations with the gradient wrap-around off, so the chunk start states are stitched but no
+#    gradient crosses a chunk boundary
+#  - "stitched": chunks more iterations with final_artificial_gradient passed back, enough for the start state
+#    gradients to travel from the last chunk to the first
+# Both are compared to the exact gradient by cosine similarity and norm ratio, next to the time of one chunked step.
+# The chunked cost is a mean over chunks * batch rows, so its gradient is scaled by chunks before the norm ratio.
+parser = argparse.ArgumentParser(description='Accuracy of chunked wrap-around gradients against full horizon BPTT')
+parser.add_argument('--pseudo_batch_size', type=int, default=10)
+parser.add_argument('--horizon', type=int, default=200)
+parser.add_argument('--trajectory_lengths', type=str, default="2,5,10,20,50,100")
+parser.add_argument('--segment', type=int, default=10)
+parser.add_argument('--checkpoint', type=str, default="", help="bike_core.model weights to analyse, random if empty")
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--repeats', type=int, default=3)
+parser.add_argument('--output', type=str, default="")
+
+
+def flatten(gradients):
+    return np.concatenate([np.ravel(g.numpy()) for g in gradients])
+
+
+def compare(gradient, exact):
+    norm = np.linalg.norm(gradient) * np.linalg.norm(exact)
+    return {"cosine": float(np.dot(gradient, exact) / norm) if norm > 0 else float("nan"),
+            "norm_ratio": float(np.linalg.norm(gradient) / np.linalg.norm(exact))}
+
+
+def timed(function, *args, repeats=3):
+    # median seconds of a compiled call after the tracing call, and the last result
+    result = function(*args)
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = tf.nest.map_structure(lambda x: x.numpy(), function(*args))
+        seconds.append(time.perf_counter() - start)
+    return float(np.median(seconds)), result
+
+
+def exact_gradient(network, config, start_states, goal_position, weights, segment, repeats):
+    rows = start_states.shape[0]
+    exact_config = dict(config, trajectory_length=config["pseudo_trajectory_length"])
+
+    @tf.function
+    def learn(start_states):
+        return checkpointed_weight_gradients(network, start_states, tf.zeros_like(start_states), rows, exact_config,
+                                             goal_position, weights, segment=segment)
+    seconds, gradients = timed(learn, start_states, repeats=repeats)
+    return seconds, np.concatenate([np.ravel(g) for g in gradients])
+
+
+def chunked_gradients(network, config, start_states, goal_position, weights, repeats):
+    # (step seconds, truncated gradient, stitched gradient) of the trainers' chunked step for config's chunk length
+    pseudo_batch_size = start_states.shape[0]
+    chunks = bike_core.chunks(config)
+    rows = pseudo_batch_size * chunks
+    goal_position = tf.constant(np.tile(goal_position, (chunks, 1)))
+
+    @tf.function
+    def learn(start_states, final_artificial_gradient):
+        with tf.GradientTape() as tape:
+            tape.watch(start_states)
+            [total_rewards, trajectory, _, trajectories_terminated] = bike_core.expand_trajectories(
+                network, start_states, final_artificial_gradient, rows, config, goal_position, weights)
+            cost_ = -tf.reduce_mean(total_rewards)
+        grads = tape.gradient(cost_, [start_states] + network.trainable_weights)
+        return grads[1:], -grads[0] * rows, trajectory[-1], trajectories_terminated
+
+    initial_state_backup = np.tile(start_states, (chunks, 1))
+    initial_state = initial_state_backup.copy()
+    final_artificial_gradient = np.zeros_like(initial_state)
+    seconds, _ = timed(learn, tf.constant(initial_state), tf.constant(final_artificial_gradient), repeats=repeats)
+    gradients = {}
+    for phase, wrap in [("truncated", False), ("stitched", True)]:
+        for _ in range(chunks):
+            grads, d_reward, final_state, trajectories_terminated = learn(tf.constant(initial_state),
+                                                                          tf.constant(final_artificial_gradient))
+            initial_state, final_artificial_gradient = bike_core.wrap_around(
+                initial_state, initial_state_backup, final_state.numpy(), trajectories_terminated.numpy(),
+                d_reward.numpy(), final_artificial_gradient, pseudo_batch_size, wrap)
+        gradients[phase] = flatten(grads) * chunks
+    return seconds, gradients["truncated"], gradients["stitched"]
+
+
+def analyse(config, trajectory_lengths, segment=10, checkpoint="", seed=0, repeats=3):
+    rng = np.random.default_rng(seed)
+    network = bike_core.build_network(config, seed=seed)
+    if checkpoint:
+        network.load_weights(checkpoint).expect_partial()
+    weights = tf.constant(bike_core.reward_weights(config))
+    start_states = bike_core.reset(config, config["pseudo_batch_size"], rng)
+    goal_position = bike_core.goal_positions(config, config["pseudo_batch_size"], rng)
+    exact_seconds, exact = exact_gradient(network, config, tf.constant(start_states), tf.constant(goal_position),
+                                          weights, segment, repeats)
+    results = [{"trajectory_length": config["pseudo_trajectory_length"], "chunks": 1, "step_seconds": exact_seconds,
+                "truncated": compare(exact, exact), "stitched": compare(exact, exact)}]
+    for length in trajectory_lengths:
+        if config["pseudo_trajectory_length"] % length or length >= config["pseudo_trajectory_length"]:
+            print("skipping trajectory_length", length, "which does not split the horizon into chunks")
+            continue
+        chunk_config = dict(config, trajectory_length=length)
+        seconds, truncated, stitched = chunked_gradients(network, chunk_config, start_states, goal_position, weights,
+                                                         repeats)
+        results.append({"trajectory_length": length, "chunks": bike_core.chunks(chunk_config),
+                        "step_seconds": seconds, "truncated": compare(truncated, exact),
+                        "stitched": compare(stitched, exact)})
+    return results
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    config = bike_core.default_config()
+    config.update(pseudo_batch_size=args.pseudo_batch_size, pseudo_trajectory_length=args.horizon)
+    results = analyse(config, [int(x) for x in args.trajectory_lengths.split(",")], args.segment, args.checkpoint,
+                      args.seed, args.repeats)
+    exact_seconds = results[0]["step_seconds"]
+    print("%8s %7s %10s %8s %12s %12s %12s %12s" % ("length", "chunks", "step s", "speedup", "trunc cos",
+                                                    "trunc ratio", "stitch cos", "stitch ratio"))
+    for result in results:
+        print("%8d %7d %10.4f %8.2f %12.4f %12.4f %12.4f %12.4f" % (
+            result["trajectory_length"], result["chunks"], result["step_seconds"],
+            exact_seconds / result["step_seconds"], result["truncated"]["cosine"], result["truncated"]["norm_ratio"],
+            result["stitched"]["cosine"], result["stitched"]["norm_ratio"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)